@@ -0,0 +1,215 @@
+"""Benchmark handler RembesBot terhadap server Bunny Storage palsu dan bot Telegram palsu.
+
+Setiap kombinasi kategori x entri per periode x ukuran gambar dijalankan pada bot baru
+(ledger, cache dan storage kosong), sehingga angka cold/warm bisa dibandingkan antar commit.
+
+Contoh:
+    python benchmark.py --categories 3,7 --entries 10,100 --image-kb 50,500 --latency-ms 20 > bench_output.txt
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from urllib.parse import unquote
+
+from PIL import Image
+
+import fullfitur
+from fullfitur import CategoryRegistry, HttpServer, RembesBot
+
+logging.getLogger().setLevel(logging.WARNING)
+
+class FakeBunnyServer:
+    """Meniru API Bunny Storage (list/GET/PUT/DELETE) di memori dengan latensi buatan."""
+    def __init__(self, zone, port, latency):
+        self.zone, self.latency = zone, latency; self.objects = {}; self.requests = 0
+        self.server = HttpServer('127.0.0.1', port, max_body=64 * 1024 * 1024); self.server.fallback = self.handle
+
+    def put_object(self, key, data, created=None):
+        self.objects[key] = (data, created or datetime.now().isoformat())
+
+    def _list(self, prefix):
+        entries, dirs = [], set()
+        for key, (data, created) in self.objects.items():
+            if not key.startswith(prefix): continue
+            rest = key[len(prefix):]
+            if '/' in rest: dirs.add(rest.split('/')[0]); continue
+            entries.append({'ObjectName': rest, 'Length': len(data), 'DateCreated': created, 'IsDirectory': False})
+        return entries + [{'ObjectName': d, 'Length': 0, 'DateCreated': '', 'IsDirectory': True} for d in sorted(dirs)]
+
+    async def handle(self, method, path, headers, body):
+        self.requests += 1; await asyncio.sleep(self.latency)
+        prefix = f"/{self.zone}/"
+        if not path.startswith(prefix): return 404, 'text/plain', b'Not Found'
+        key = unquote(path[len(prefix):])
+        if method == 'GET' and (key == '' or key.endswith('/')): return 200, 'application/json', json.dumps(self._list(key)).encode()
+        if method == 'GET':
+            obj = self.objects.get(key)
+            return (200, 'application/octet-stream', obj[0]) if obj else (404, 'text/plain', b'Not Found')
+        if method == 'PUT': self.put_object(key, body); return 201, 'application/json', b'{}'
+        if method == 'DELETE':
+            return (200, 'application/json', b'{}') if self.objects.pop(key, None) else (404, 'text/plain', b'Not Found')
+        return 405, 'text/plain', b'Method Not Allowed'
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, text=''):
+        self.text = text; self.message_id = next(self._ids); self.photo = []; self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text); return FakeMessage(text)
+
+class FakeFile:
+    def __init__(self, file_id, data):
+        self.file_id, self.data = file_id, data
+
+    async def download_to_drive(self, path):
+        with open(path, 'wb') as f: f.write(self.data)
+
+class FakeBot:
+    def __init__(self, image_bytes):
+        self.image_bytes = image_bytes; self.documents = []; self.edits = 0
+
+    async def edit_message_text(self, *args, **kwargs): self.edits += 1
+    async def send_message(self, *args, **kwargs): return FakeMessage()
+    async def send_photo(self, *args, **kwargs): return FakeMessage()
+    async def delete_message(self, *args, **kwargs): return True
+    async def get_file(self, file_id): return FakeFile(file_id, self.image_bytes)
+
+    async def send_document(self, chat_id, document, filename=None, **kwargs):
+        size = len(document) if isinstance(document, bytes) else len(document.read())
+        self.documents.append((filename, size)); return FakeMessage()
+
+class FakeApplication:
+    def __init__(self):
+        self.tasks = []
+
+    def create_task(self, coroutine, update=None):
+        task = asyncio.create_task(coroutine); self.tasks.append(task); return task
+
+    async def drain(self):
+        while self.tasks:
+            tasks, self.tasks = self.tasks, []; await asyncio.gather(*tasks)
+
+def make_update(text='', user_id=1):
+    return SimpleNamespace(
+        message=FakeMessage(text), effective_chat=SimpleNamespace(id=1), effective_user=SimpleNamespace(id=user_id), callback_query=None
+    )
+
+def make_context(bot, application, args=None, user_data=None):
+    return SimpleNamespace(bot=bot, application=application, args=args or [], user_data={} if user_data is None else user_data)
+
+def make_image(size_kb, seed=0):
+    """Gambar JPEG berisi noise (sulit dikompres) dengan ukuran kira-kira size_kb."""
+    side = max(16, int((size_kb * 1024 / 1.2) ** 0.5)); rng = random.Random(seed)
+    img = Image.frombytes('RGB', (side, side), bytes(rng.getrandbits(8) for _ in range(side * side * 3)))
+    buffer = io.BytesIO(); img.save(buffer, 'JPEG', quality=90); return buffer.getvalue()
+
+async def measure(repeat, concurrency, call):
+    latencies = []
+    async def one():
+        t0 = time.perf_counter(); await call(); latencies.append(time.perf_counter() - t0)
+    start = time.perf_counter()
+    for _ in range(repeat): await asyncio.gather(*(one() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'p50_ms': statistics.median(latencies) * 1000, 'max_ms': latencies[-1] * 1000,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+async def run_cell(args, categories, entries, image_kb, port):
+    workdir = tempfile.mkdtemp(prefix='rembes_bench_')
+    fake = FakeBunnyServer('bench', port, args.latency_ms / 1000); await fake.server.start()
+    config = fullfitur.Config
+    config.BUNNY_ENDPOINT, config.BUNNY_STORAGE_ZONE_NAME, config.BUNNY_ACCESS_KEY = f"http://127.0.0.1:{port}", 'bench', 'bench'
+    config.LEDGER_FILE = os.path.join(workdir, 'ledger.db'); config.CACHE_DIR = os.path.join(workdir, 'cache')
+    config.CONFIG_FILE = os.path.join(workdir, 'config.json'); config.GROUP_CHAT_ID = None
+    names = [f"kat{chr(97 + i // 26)}{chr(97 + i % 26)}" for i in range(categories)]
+    with open(config.CONFIG_FILE, 'w') as f: json.dump({'commands': names}, f)
+    bot = RembesBot(); bot.commands = CategoryRegistry(config.CONFIG_FILE)
+    period = bot._get_current_period()[0]
+    image = make_image(image_kb); thumb = make_image(8, seed=1); base = datetime(2000, 1, 1)
+    for name in names:
+        for i in range(entries):
+            ts = (base + timedelta(seconds=i)).strftime('%Y%m%d_%H%M%S'); file_name = f"{ts}_Struk_{i}_{1000 + i}.jpg"
+            fake.put_object(f"{name}/{period}/{file_name}", image, (base + timedelta(seconds=i)).isoformat())
+            fake.put_object(f"thumb/{name}/{period}/{file_name}", thumb)
+    telegram = FakeBot(image); application = FakeApplication(); results = []
+    cell = {'categories': categories, 'entries': entries, 'image_kb': round(len(image) / 1024)}
+
+    async def summary(): await bot.summary_command(make_update('/summary'), make_context(telegram, application))
+    async def list_data(): await bot.list_data(make_update('/list'), make_context(telegram, application))
+    user_ids = itertools.count(1)
+    async def export():
+        await bot.export_data(make_update('/export', next(user_ids)), make_context(telegram, application)); await application.drain()
+    async def export_csv():
+        await bot.export_data(make_update('/export csv', next(user_ids)), make_context(telegram, application, ['csv'])); await application.drain()
+    edit_targets = itertools.cycle(range(entries))
+    async def edit():
+        index = next(edit_targets); bot._invalidate_listing(names[0], period)
+        files = sorted(await bot._list_period(names[0], period), key=lambda x: x['DateCreated'])
+        user_data = {'edit_category': names[0], 'edit_period': period, 'edit_file': files[index % len(files)], 'edit_field': 'bia'}
+        await bot.get_new_value_and_save(make_update(str(random.randint(1, 10 ** 6))), make_context(telegram, application, user_data=user_data))
+
+    scenarios = [
+        ('summary (cold)', summary, 1, 1), ('summary (warm)', summary, args.repeat, args.concurrency),
+        ('list (warm)', list_data, args.repeat, args.concurrency),
+        ('export (cold)', export, 1, 1), ('export (warm)', export, args.repeat, args.concurrency),
+        ('export csv', export_csv, args.repeat, args.concurrency),
+        ('edit', edit, args.repeat, 1),
+    ]
+    try:
+        for name, call, repeat, concurrency in scenarios:
+            requests_before = fake.requests
+            stats = await measure(repeat, concurrency, call)
+            stats['storage_requests'] = (fake.requests - requests_before) / (repeat * concurrency)
+            if name.startswith('export') and telegram.documents: stats['doc_kb'] = round(telegram.documents[-1][1] / 1024)
+            results.append({'scenario': name, **cell, **stats})
+    finally:
+        await bot.post_shutdown(None); await fake.server.stop(); shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def print_table(rows):
+    header = f"{'scenario':<16}{'cats':>6}{'entries':>9}{'img_kb':>8}{'p50_ms':>10}{'max_ms':>10}{'ops/s':>9}{'storage/op':>12}{'doc_kb':>8}"
+    print(header); print('-' * len(header))
+    for r in rows:
+        print(
+            f"{r['scenario']:<16}{r['categories']:>6}{r['entries']:>9}{r['image_kb']:>8}{r['p50_ms']:>10.1f}{r['max_ms']:>10.1f}"
+            f"{r['throughput']:>9.1f}{r['storage_requests']:>12.1f}{r.get('doc_kb', ''):>8}"
+        )
+
+def parse_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--categories', type=parse_list, default=[3, 7])
+    parser.add_argument('--entries', type=parse_list, default=[10, 50])
+    parser.add_argument('--image-kb', type=parse_list, default=[50, 500])
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Latensi buatan per request storage")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=4, help="Jumlah pemanggilan paralel untuk skenario warm")
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--json', action='store_true', help="Cetak hasil sebagai JSON lines")
+    args = parser.parse_args()
+    rows = []
+    for categories, entries, image_kb in itertools.product(args.categories, args.entries, args.image_kb):
+        rows.extend(await run_cell(args, categories, entries, image_kb, args.port))
+    if args.json:
+        for row in rows: print(json.dumps(row))
+    else: print_table(rows)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,13 +1,32 @@
 import os
 import re
+import io
+import csv
+import zipfile
 import sys
+import signal
 import logging
+import logging.handlers
+import queue
+import atexit
+import contextvars
 import json
-import requests
+import hashlib
+import asyncio
+import httpx
 import tempfile
 import shutil
-from datetime import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import sqlite3
+import time
+import random
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from http import HTTPStatus
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import (
     Application, # Ditambahkan untuk post_init
     ApplicationBuilder, CommandHandler, MessageHandler, filters,
@@ -15,113 +34,1128 @@ from telegram.ext import (
 )
 from docx import Document
 from docx.shared import Inches
+from openpyxl import Workbook
 from dotenv import load_dotenv
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 
 # Muat variabel dari file .env
 load_dotenv()
 
-# Konfigurasi Logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('rembes_bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
+# Konteks update yang sedang diproses (user, command, category), ikut tercatat di setiap log handler tersebut
+log_context = contextvars.ContextVar('log_context', default={})
+
+class Metrics:
+    """Counter dan ringkasan latensi di memori, bisa dirender ke format teks Prometheus."""
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, window=2048):
+        self.window = window; self.counters = {}; self.samples = {}; self.sums = {}; self.counts = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels); self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        self.samples.setdefault(key, deque(maxlen=self.window)).append(value)
+        self.sums[key] = self.sums.get(key, 0.0) + value; self.counts[key] = self.counts.get(key, 0) + 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try: yield
+        finally: self.observe(name, time.perf_counter() - started, **labels)
+
+    def quantile(self, name, q, **labels):
+        values = sorted(self.samples.get(self._key(name, labels), ()))
+        return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+    def summaries(self, name):
+        """(label, jumlah, p50, p99) untuk setiap seri metrik `name`."""
+        return [
+            (dict(labels), self.counts[(n, labels)], self.quantile(n, 0.5, **dict(labels)), self.quantile(n, 0.99, **dict(labels)))
+            for n, labels in sorted(self.samples) if n == name
+        ]
+
+    @staticmethod
+    def _format_labels(labels, **extra):
+        items = list(labels) + sorted(extra.items())
+        return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}" if items else ""
+
+    def render(self):
+        lines, typed = [], set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed: lines.append(f"# TYPE {name} counter"); typed.add(name)
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+        for (name, labels), values in sorted(self.samples.items()):
+            if name not in typed: lines.append(f"# TYPE {name} summary"); typed.add(name)
+            ordered = sorted(values)
+            for q in self.QUANTILES:
+                lines.append(f"{name}{self._format_labels(labels, quantile=q)} {ordered[min(len(ordered) - 1, int(q * len(ordered)))]:.6f}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {self.sums[(name, labels)]:.6f}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {self.counts[(name, labels)]}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
 
 class Config:
     TOKEN = os.getenv('BOT_TOKEN')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+    # Webhook menurunkan latensi, bukan untuk skala horizontal: state percakapan, ledger SQLite, JobManager
+    # dan cache listing hanya ada di satu proses, jadi bot harus berjalan sebagai satu replika (lihat _acquire_instance_lock)
+    BOT_MODE = os.getenv('BOT_MODE', 'webhook' if WEBHOOK_URL else 'polling').lower()
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+    CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '1'))
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+    ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}
     GROUP_CHAT_ID = os.getenv('GROUP_CHAT_ID')
+    # Zona waktu periode, scheduler, dan timestamp entri (container biasanya berjalan dalam UTC)
+    TIMEZONE = os.getenv('BOT_TIMEZONE', 'Asia/Jakarta')
     BUNNY_STORAGE_ZONE_NAME = os.getenv('BUNNY_STORAGE_ZONE_NAME')
     BUNNY_ACCESS_KEY = os.getenv('BUNNY_ACCESS_KEY')
     BUNNY_REGION = os.getenv('BUNNY_REGION', '')
+    # Override endpoint storage, mis. untuk server Bunny palsu di benchmark
+    BUNNY_ENDPOINT = os.getenv('BUNNY_ENDPOINT', '')
+    BUNNY_POOL_SIZE = int(os.getenv('BUNNY_POOL_SIZE', '10'))
+    BUNNY_TIMEOUT = float(os.getenv('BUNNY_TIMEOUT', '30'))
+    BUNNY_CONNECT_TIMEOUT = float(os.getenv('BUNNY_CONNECT_TIMEOUT', '5'))
+    BUNNY_RETRIES = int(os.getenv('BUNNY_RETRIES', '3'))
+    BUNNY_RETRY_BACKOFF = float(os.getenv('BUNNY_RETRY_BACKOFF', '0.5'))
+    BUNNY_BREAKER_THRESHOLD = int(os.getenv('BUNNY_BREAKER_THRESHOLD', '5'))
+    BUNNY_BREAKER_RESET = float(os.getenv('BUNNY_BREAKER_RESET', '30'))
+    HEALTH_PROBE_INTERVAL = float(os.getenv('HEALTH_PROBE_INTERVAL', '30'))
+    HEALTH_PROBE_TIMEOUT = float(os.getenv('HEALTH_PROBE_TIMEOUT', '5'))
+    HEALTH_PROBE_WINDOW = int(os.getenv('HEALTH_PROBE_WINDOW', '20'))
+    LIST_CACHE_TTL = float(os.getenv('LIST_CACHE_TTL', '60'))
+    LIST_CONCURRENCY = int(os.getenv('LIST_CONCURRENCY', '5'))
+    LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', '20'))
+    EXPORT_DOWNLOAD_WORKERS = int(os.getenv('EXPORT_DOWNLOAD_WORKERS', '8'))
+    IMAGE_PROCESS_WORKERS = int(os.getenv('IMAGE_PROCESS_WORKERS', str(os.cpu_count() or 2)))
+    # 1.5 inci pada ~200 DPI
+    EXPORT_THUMB_SIZE = int(os.getenv('EXPORT_THUMB_SIZE', '300'))
+    EXPORT_THUMB_QUALITY = int(os.getenv('EXPORT_THUMB_QUALITY', '70'))
+    INGEST_MAX_SIZE = int(os.getenv('INGEST_MAX_SIZE', '1600'))
+    INGEST_QUALITY = int(os.getenv('INGEST_QUALITY', '80'))
+    ALBUM_COLLECT_SECONDS = float(os.getenv('ALBUM_COLLECT_SECONDS', '1.5'))
+    UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', '4'))
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+    JOB_PER_USER_LIMIT = int(os.getenv('JOB_PER_USER_LIMIT', '1'))
+    # Pra-bangun laporan menjelang tenggat tanggal 24: build penuh tiap malam mulai PREBUILD_START_DAY (0 = nonaktif),
+    # lalu refresh tiap PREBUILD_INTERVAL_MINUTES (0 = hanya build malam)
+    PREBUILD_START_DAY = int(os.getenv('PREBUILD_START_DAY', '20'))
+    PREBUILD_HOUR = int(os.getenv('PREBUILD_HOUR', '2'))
+    PREBUILD_INTERVAL_MINUTES = int(os.getenv('PREBUILD_INTERVAL_MINUTES', '30'))
+    # Batas unggah dokumen Bot API
+    EXPORT_MAX_UPLOAD_MB = int(os.getenv('EXPORT_MAX_UPLOAD_MB', '50'))
+    # Jarak Hamming maksimum dHash agar dua foto dianggap mirip; -1 mematikan deteksi perseptual
+    DEDUPE_DHASH_DISTANCE = int(os.getenv('DEDUPE_DHASH_DISTANCE', '6'))
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     CONFIG_FILE = os.path.join(BASE_DIR, 'config.json')
+    LEDGER_FILE = os.getenv('LEDGER_DB', os.path.join(BASE_DIR, 'rembes_ledger.db'))
+    CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(BASE_DIR, 'cache'))
+    IMAGE_CACHE_MAX_MB = int(os.getenv('IMAGE_CACHE_MAX_MB', '200'))
+    LOG_FILE = os.getenv('LOG_FILE', 'rembes_bot.log')
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    # 'text' (format lama) atau 'json' (satu objek JSON per baris)
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+    # Rotasi berdasarkan waktu jika diisi (mis. 'midnight'), selain itu berdasarkan ukuran LOG_MAX_BYTES
+    LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+
+class JsonLogFormatter(logging.Formatter):
+    """Satu objek JSON per baris, termasuk field konteks dari `log_context` atau `extra`.
+
+    Traceback sudah digabung ke `message` oleh QueueHandler sebelum record masuk antrean.
+    """
+    FIELDS = ('user', 'command', 'handler', 'state', 'category', 'status', 'duration_ms')
+
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+        entry.update((field, getattr(record, field)) for field in self.FIELDS if getattr(record, field, None) is not None)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LogContextFilter(logging.Filter):
+    """Menempelkan konteks update ke record; berjalan di thread pemanggil, sebelum record masuk antrean."""
+    def filter(self, record):
+        for field, value in log_context.get().items():
+            if not hasattr(record, field): setattr(record, field, value)
+        return True
+
+def configure_logging(config):
+    """Logger hanya memasukkan record ke antrean; thread QueueListener yang menulis ke file berotasi dan konsol."""
+    if config.LOG_ROTATE_WHEN:
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            config.LOG_FILE, when=config.LOG_ROTATE_WHEN, backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            config.LOG_FILE, maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    formatter = JsonLogFormatter() if config.LOG_FORMAT == 'json' else logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler): handler.setFormatter(formatter)
+    log_queue = queue.Queue(-1); queue_handler = logging.handlers.QueueHandler(log_queue); queue_handler.addFilter(LogContextFilter())
+    root = logging.getLogger(); root.setLevel(config.LOG_LEVEL); root.handlers[:] = [queue_handler]
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start(); atexit.register(listener.stop)
+    return listener
+
+log_listener = configure_logging(Config)
+
+def make_thumbnail(src_path, dst_path, max_size, quality):
+    """Decode, putar sesuai EXIF, perkecil dan kompres ulang gambar (dijalankan di process pool)."""
+    with Image.open(src_path) as img:
+        img = ImageOps.exif_transpose(img); img.thumbnail((max_size, max_size))
+        if img.mode not in ('RGB', 'L'): img = img.convert('RGB')
+        img.save(dst_path, 'JPEG', quality=quality, optimize=True)
+    return dst_path
+
+def image_dhash(img, size=8):
+    """Difference hash 64 bit (hex): tetap sama walau foto dikompres ulang atau diubah ukurannya."""
+    pixels = list(img.convert('L').resize((size + 1, size), Image.LANCZOS).getdata()); bits = 0
+    for row in range(size):
+        for col in range(size):
+            bits = (bits << 1) | (pixels[row * (size + 1) + col] > pixels[row * (size + 1) + col + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+def file_sha256(path):
+    with open(path, 'rb') as f: return hashlib.sha256(f.read()).hexdigest()
+
+def normalize_image(src_path, dst_path, thumb_path, max_size, quality, thumb_size, thumb_quality):
+    """Normalisasi foto saat diunggah: putar sesuai EXIF, batasi resolusi, kompres ulang, buat thumbnail dan dHash."""
+    with Image.open(src_path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'L'): img = img.convert('RGB')
+        dhash = image_dhash(img)
+        img.thumbnail((max_size, max_size)); img.save(dst_path, 'JPEG', quality=quality, optimize=True)
+        img.thumbnail((thumb_size, thumb_size)); img.save(thumb_path, 'JPEG', quality=thumb_quality, optimize=True)
+    return dst_path, thumb_path, dhash
+
+EXPORT_COLUMNS = ['Kategori', 'Tanggal & Waktu', 'Keterangan', 'Biaya (Rp)']
+
+def render_csv(rows):
+    """CSV (UTF-8 dengan BOM agar terbaca benar di Excel) dari baris (kategori, tanggal, keterangan, biaya)."""
+    buffer = io.StringIO(); writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    writer.writerows((category, tanggal.strftime('%Y-%m-%d %H:%M:%S'), keterangan, biaya) for category, tanggal, keterangan, biaya in rows)
+    return buffer.getvalue().encode('utf-8-sig')
+
+def render_xlsx(rows):
+    """Workbook mode write-only: sheet rincian plus sheet ringkasan per kategori."""
+    workbook = Workbook(write_only=True); detail = workbook.create_sheet('Rincian'); totals = {}
+    detail.append(EXPORT_COLUMNS)
+    for category, tanggal, keterangan, biaya in rows:
+        detail.append([category, tanggal, keterangan, biaya]); totals[category] = totals.get(category, 0) + biaya
+    summary = workbook.create_sheet('Ringkasan'); summary.append(['Kategori', 'Total (Rp)'])
+    for category, total in totals.items(): summary.append([category, total])
+    summary.append(['Grand Total', sum(totals.values())])
+    buffer = io.BytesIO(); workbook.save(buffer); return buffer.getvalue()
+
+class RequestTooLargeError(ValueError):
+    """Body request melebihi batas HttpServer.max_body (dijawab 413)."""
+
+class HttpServer:
+    """Server HTTP/1.1 minimal di atas asyncio untuk webhook dan health check."""
+    def __init__(self, host, port, max_body=1024 * 1024):
+        self.host, self.port, self.max_body = host, port, max_body
+        self.routes = {}; self.fallback = None; self.server = None
+
+    def route(self, method, path, handler):
+        self.routes[(method, path)] = handler
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"HTTP server mendengarkan di {self.host}:{self.port}")
+
+    async def stop(self):
+        if self.server: self.server.close(); await self.server.wait_closed()
+
+    async def _read_request(self, reader):
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2); headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''): break
+            name, _, value = line.decode('latin-1').partition(':'); headers[name.strip().lower()] = value.strip()
+        encoding = headers.get('transfer-encoding', '').lower()
+        if encoding == 'chunked': body = await self._read_chunked(reader)
+        elif encoding: raise ValueError(f"Transfer-Encoding tidak didukung: {encoding}")
+        else:
+            length = int(headers.get('content-length', 0))
+            if length > self.max_body: raise RequestTooLargeError("Body terlalu besar")
+            body = await reader.readexactly(length) if length else b''
+        return method, target.split('?')[0], headers, body
+
+    async def _read_chunked(self, reader):
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b';')[0].strip(), 16)
+            if size == 0: break
+            if len(body) + size > self.max_body: raise RequestTooLargeError("Body terlalu besar")
+            body += await reader.readexactly(size); await reader.readexactly(2)
+        # Lewati trailer sampai baris kosong penutup
+        while await reader.readline() not in (b'\r\n', b'\n', b''): pass
+        return bytes(body)
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, headers, body = await asyncio.wait_for(self._read_request(reader), timeout=10)
+            handler = self.routes.get((method, path))
+            if handler: status, content_type, payload = await handler(headers, body)
+            elif self.fallback: status, content_type, payload = await self.fallback(method, path, headers, body)
+            else: status, content_type, payload = 404, 'text/plain', b'Not Found'
+        except RequestTooLargeError:
+            status, content_type, payload = 413, 'text/plain', b'Payload Too Large'
+        except (ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            status, content_type, payload = 400, 'text/plain', b'Bad Request'
+        except Exception as e:
+            logger.error(f"Kesalahan HTTP server: {e}"); status, content_type, payload = 500, 'text/plain', b'Internal Server Error'
+        head = (
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n"
+        )
+        try:
+            writer.write(head.encode() + payload); await writer.drain()
+        except ConnectionError: pass
+        finally: writer.close()
+
+class StorageUnavailableError(httpx.TransportError):
+    """Dilempar tanpa menghubungi Bunny selama circuit breaker terbuka."""
+
+class CircuitBreaker:
+    """Setelah `threshold` operasi gagal beruntun, tolak semua request selama `reset_timeout` detik.
+
+    Sesudahnya (half-open) hanya satu request percobaan yang dilewatkan; hasilnya menutup atau membuka lagi breaker.
+    """
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold, self.reset_timeout = threshold, reset_timeout
+        self.failures = 0; self.opened_at = None; self.trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None: return 'closed'
+        return 'open' if time.monotonic() - self.opened_at < self.reset_timeout else 'half-open'
+
+    def retry_in(self):
+        return max(0, int(self.reset_timeout - (time.monotonic() - self.opened_at))) if self.opened_at else 0
+
+    def allow(self):
+        state = self.state
+        if state == 'closed': return True
+        if state == 'open' or self.trial: return False
+        self.trial = True; return True
+
+    def release_trial(self):
+        """Lepas slot percobaan yang berakhir tanpa hasil (mis. dibatalkan) agar request berikutnya bisa mencoba."""
+        self.trial = False
+
+    def record_success(self):
+        if self.opened_at is not None: logger.info("Storage kembali sehat, circuit breaker ditutup.")
+        self.failures = 0; self.opened_at = None; self.trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial or (self.opened_at is None and self.failures >= self.threshold):
+            logger.warning(f"Circuit breaker storage terbuka setelah {self.failures} kegagalan beruntun.")
+            self.opened_at = time.monotonic()
+        self.trial = False
 
 class BunnyStorage:
-    def __init__(self, zone_name, access_key, region=''):
+    # Hasil move_file: dipindahkan, tersalin tapi file lama gagal dihapus, atau gagal sama sekali
+    MOVED, COPIED, FAILED = 'moved', 'copied', 'failed'
+
+    def __init__(self, zone_name, access_key, region='', pool_size=10, timeout=30.0, endpoint='', connect_timeout=5.0,
+                 retries=3, retry_backoff=0.5, breaker_threshold=5, breaker_reset=30.0):
         base_url = "storage.bunnycdn.com"
         if region and region.lower() != 'de':
             base_url = f"{region}.{base_url}"
-        self.api_url = f"https://{base_url}/{zone_name}/"
+        self.api_url = f"{endpoint.rstrip('/') if endpoint else f'https://{base_url}'}/{zone_name}/"
         self.headers = {"AccessKey": access_key}
+        self.connect_timeout = connect_timeout; self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.retries, self.retry_backoff = retries, retry_backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        # Satu client bersama agar koneksi keep-alive ke Bunny dipakai ulang antar request
+        self.client = httpx.AsyncClient(
+            headers=self.headers, timeout=self.timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
 
-    def check_connection(self):
-        return self.list_files('') is not None
+    async def close(self):
+        await self.client.aclose()
 
-    def list_files(self, remote_path):
+    def _timeout(self, timeout):
+        return httpx.Timeout(timeout, connect=self.connect_timeout) if timeout else self.timeout
+
+    def _record(self, operation, status, started, nbytes=0):
+        metrics.observe('bunny_request_duration_seconds', time.perf_counter() - started, operation=operation)
+        metrics.inc('bunny_requests_total', operation=operation, status=str(status))
+        if nbytes: metrics.inc('bunny_bytes_total', nbytes, operation=operation)
+
+    async def _call(self, operation, attempt_func):
+        """Menjalankan satu operasi (idempoten) dengan circuit breaker dan retry eksponensial ber-jitter.
+
+        `attempt_func` mengembalikan (hasil, status HTTP, jumlah byte); status 5xx dan error koneksi dicoba ulang.
+        """
+        if not self.breaker.allow():
+            metrics.inc('bunny_requests_total', operation=operation, status='circuit_open')
+            raise StorageUnavailableError(f"Storage sedang terganggu, coba lagi dalam {self.breaker.retry_in()} detik.")
+        # Breaker menghitung satu kegagalan per operasi setelah retry habis; selama breaker tidak tertutup
+        # (termasuk request percobaan half-open) tidak ada retry
+        trial, attempt = self.breaker.trial, 0
+        try:
+            while True:
+                started, status, nbytes = time.perf_counter(), 'error', 0
+                try:
+                    result, status, nbytes = await attempt_func()
+                except httpx.TransportError as e:
+                    if attempt >= self.retries or self.breaker.state != 'closed': self.breaker.record_failure(); raise
+                    logger.warning(f"Bunny {operation} gagal: {e!r}. Mencoba lagi ({attempt + 1}/{self.retries})...")
+                else:
+                    if status < 500: self.breaker.record_success(); return result
+                    if attempt >= self.retries or self.breaker.state != 'closed': self.breaker.record_failure(); return result
+                    logger.warning(f"Bunny {operation} mengembalikan {status}. Mencoba lagi ({attempt + 1}/{self.retries})...")
+                finally: self._record(operation, status, started, nbytes)
+                attempt += 1; await asyncio.sleep(random.uniform(0, min(10.0, self.retry_backoff * 2 ** attempt)))
+        finally:
+            # Percobaan half-open yang berakhir tanpa hasil (dibatalkan/exception lain) tidak boleh mengunci breaker
+            if trial and self.breaker.trial: self.breaker.release_trial()
+
+    async def _send(self, operation, method, remote_path, timeout=None, **kwargs):
+        async def attempt():
+            response = await self.client.request(method, self.api_url + remote_path, timeout=self._timeout(timeout), **kwargs)
+            return response, response.status_code, len(kwargs.get('content') or b'') + len(response.content)
+        return await self._call(operation, attempt)
+
+    async def probe(self, timeout=None):
+        """Satu request ringan tanpa retry dan di luar circuit breaker: listing folder yang tidak ada."""
+        started, status = time.perf_counter(), 'error'
         try:
-            response = requests.get(self.api_url + remote_path, headers=self.headers)
+            response = await self.client.get(self.api_url + '.health/', timeout=self._timeout(timeout)); status = response.status_code
+            return status in (200, 404), status
+        finally: self._record('probe', status, started)
+
+    async def list_files(self, remote_path, timeout=None):
+        try:
+            response = await self._send('list', 'GET', remote_path, timeout)
             if response.status_code == 200: return response.json()
             elif response.status_code == 404: return []
             logger.error(f"Bunny API Error (List): {response.status_code} - {response.text}"); return None
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Bunny Connection Error (List): {e}"); return None
 
-    def upload_file(self, local_file_path, remote_file_path):
-        headers = self.headers.copy(); headers["Content-Type"] = "application/octet-stream"
+    async def upload_file(self, local_file_path, remote_file_path, timeout=None):
+        try: data = await asyncio.to_thread(self._read_file, local_file_path)
+        except OSError as e:
+            logger.error(f"Gagal membaca file untuk diunggah: {e}"); return False
+        return await self.upload_bytes(data, remote_file_path, timeout)
+
+    async def upload_bytes(self, data, remote_file_path, timeout=None):
+        headers = {"Content-Type": "application/octet-stream"}
         try:
-            with open(local_file_path, 'rb') as f:
-                response = requests.put(self.api_url + remote_file_path, headers=headers, data=f)
-                return response.status_code == 201
-        except requests.exceptions.RequestException as e:
+            response = await self._send('upload', 'PUT', remote_file_path, timeout, headers=headers, content=data)
+            return response.status_code == 201
+        except httpx.HTTPError as e:
             logger.error(f"Bunny Connection Error (Upload): {e}"); return False
 
-    def download_file(self, remote_file_path, local_file_path):
+    async def download_bytes(self, remote_file_path, timeout=None):
         try:
-            response = requests.get(self.api_url + remote_file_path, headers=self.headers, stream=True)
-            if response.status_code == 200:
-                with open(local_file_path, 'wb') as f: shutil.copyfileobj(response.raw, f)
-                return True
-            return False
-        except requests.exceptions.RequestException as e:
+            response = await self._send('download', 'GET', remote_file_path, timeout)
+            if response.status_code == 200: return response.content
+            if response.status_code != 404: logger.error(f"Bunny API Error (Download): {response.status_code} - {response.text}")
+            return None
+        except httpx.HTTPError as e:
+            logger.error(f"Bunny Connection Error (Download): {e}"); return None
+
+    async def download_file(self, remote_file_path, local_file_path, timeout=None):
+        async def attempt():
+            async with self.client.stream('GET', self.api_url + remote_file_path, timeout=self._timeout(timeout)) as response:
+                if response.status_code != 200: return False, response.status_code, 0
+                with open(local_file_path, 'wb') as f:
+                    async for chunk in response.aiter_bytes(): f.write(chunk)
+                return True, 200, response.num_bytes_downloaded
+        try: return await self._call('download', attempt)
+        except (httpx.HTTPError, OSError) as e:
             logger.error(f"Bunny Connection Error (Download): {e}"); return False
 
-    def delete_file(self, remote_file_path):
+    async def delete_file(self, remote_file_path, timeout=None):
         try:
-            response = requests.delete(self.api_url + remote_file_path, headers=self.headers)
+            response = await self._send('delete', 'DELETE', remote_file_path, timeout)
             if response.status_code == 200:
                 logger.info(f"File '{remote_file_path}' berhasil dihapus."); return True, "✅ File berhasil dihapus."
             elif response.status_code == 404:
                 logger.warning(f"Gagal hapus, file tidak ditemukan: '{remote_file_path}'."); return True, "ℹ️ File tidak ditemukan (mungkin sudah dihapus)."
             logger.error(f"Bunny API Error (Delete): {response.status_code} - {response.text}"); return False, f"❌ Gagal menghapus file. Error: {response.status_code}"
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             logger.error(f"Bunny Connection Error (Delete): {e}"); return False, "❌ Gagal terhubung ke storage."
 
+    async def copy_file(self, src_file_path, dst_file_path, timeout=None, missing_ok=False):
+        """Menyalin objek dengan mengalirkan body GET langsung ke PUT, tanpa file sementara.
+
+        Salinan dianggap terverifikasi bila PUT menjawab 201 dan jumlah byte yang dialirkan sama dengan
+        Content-Length sumber. Dengan `missing_ok`, sumber yang tidak ada (404) tidak dicatat sebagai error.
+        """
+        async def attempt():
+            # Setiap percobaan membuka GET baru, jadi retry aman walau body PUT berupa stream.
+            # Minta body tanpa content-encoding dan alirkan byte mentah supaya sama persis dengan Content-Length.
+            async with self.client.stream(
+                'GET', self.api_url + src_file_path, headers={"Accept-Encoding": "identity"}, timeout=self._timeout(timeout)
+            ) as source:
+                if source.status_code == 404 and missing_ok:
+                    logger.debug(f"Sumber '{src_file_path}' tidak ada, salinan dilewati."); return None, 404, 0
+                if source.status_code != 200:
+                    logger.error(f"Bunny API Error (Copy): {source.status_code} saat membaca '{src_file_path}'"); return None, source.status_code, 0
+                headers = {"Content-Type": "application/octet-stream"}
+                if 'Content-Length' in source.headers: headers['Content-Length'] = source.headers['Content-Length']
+                response = await self.client.put(self.api_url + dst_file_path, headers=headers, content=source.aiter_raw(), timeout=self._timeout(timeout))
+                if response.status_code != 201:
+                    logger.error(f"Bunny API Error (Copy): {response.status_code} saat menulis '{dst_file_path}'"); return None, response.status_code, 0
+                length = int(source.headers.get('Content-Length', -1))
+                if length >= 0 and source.num_bytes_downloaded != length:
+                    logger.error(f"Salinan '{dst_file_path}' tidak lengkap: {source.num_bytes_downloaded}/{length} byte"); return None, 201, source.num_bytes_downloaded
+                return source.num_bytes_downloaded, 201, source.num_bytes_downloaded
+        try: return await self._call('copy', attempt)
+        except httpx.HTTPError as e:
+            logger.error(f"Bunny Connection Error (Copy): {e}"); return None
+
+    async def verify_files(self, expected):
+        """Cocokkan {path: panjang} dengan satu listing per folder tujuan; kembalikan path yang terverifikasi."""
+        folders = {}
+        for path, length in expected.items():
+            directory, _, name = path.rpartition('/'); folders.setdefault(directory, {})[name] = length
+        verified = set()
+        for directory, names in folders.items():
+            for f in await self.list_files(f"{directory}/" if directory else '') or []:
+                if f['ObjectName'] in names and f.get('Length') == names[f['ObjectName']]: verified.add(f"{directory}/{f['ObjectName']}" if directory else f['ObjectName'])
+        return verified
+
+    async def _finish_move(self, src_file_path):
+        success, message = await self.delete_file(src_file_path)
+        if not success: return self.COPIED, f"⚠️ File tersalin, tetapi file lama gagal dihapus: {message}"
+        return self.MOVED, "✅ File berhasil dipindahkan."
+
+    async def move_file(self, src_file_path, dst_file_path, missing_ok=False):
+        """Memindahkan objek: salin (terverifikasi lewat respons PUT), baru hapus aslinya.
+
+        Mengembalikan (MOVED | COPIED | FAILED, pesan); COPIED berarti file lama dan salinannya sama-sama masih ada.
+        """
+        if await self.copy_file(src_file_path, dst_file_path, missing_ok=missing_ok) is None: return self.FAILED, "❌ Gagal menyalin file."
+        return await self._finish_move(src_file_path)
+
+    async def move_files(self, pairs, concurrency=4, missing_ok=False):
+        """Memindahkan banyak objek: salin semuanya, verifikasi sekali per folder tujuan, lalu hapus aslinya."""
+        semaphore = asyncio.Semaphore(concurrency)
+        async def limited(coroutine):
+            async with semaphore: return await coroutine
+        lengths = await asyncio.gather(*(limited(self.copy_file(src, dst, missing_ok=missing_ok)) for src, dst in pairs))
+        verified = await self.verify_files({dst: length for (_, dst), length in zip(pairs, lengths) if length is not None})
+        async def finish(src, dst, length):
+            if length is None: return self.FAILED, "❌ Gagal menyalin file."
+            if dst not in verified:
+                logger.error(f"Verifikasi salinan gagal: '{dst}'"); return self.FAILED, "❌ Salinan file tidak terverifikasi, file asli tidak dihapus."
+            return await limited(self._finish_move(src))
+        return await asyncio.gather(*(finish(src, dst, length) for (src, dst), length in zip(pairs, lengths)))
+
+    @staticmethod
+    def _read_file(path):
+        with open(path, 'rb') as f: return f.read()
+
+class HealthMonitor:
+    """Probe storage berkala di latar belakang; /status cukup membaca hasil terakhir."""
+    def __init__(self, storage, interval=30.0, timeout=5.0, window=20):
+        self.storage, self.interval, self.timeout = storage, interval, timeout
+        # (berhasil, latensi detik) untuk `window` probe terakhir
+        self.samples = deque(maxlen=window); self.last_success = None; self.last_error = None; self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try: await self.task
+            except asyncio.CancelledError: pass
+
+    async def _run(self):
+        while True:
+            await self.probe(); await asyncio.sleep(self.interval)
+
+    async def probe(self):
+        started = time.perf_counter()
+        try: ok, status = await self.storage.probe(self.timeout)
+        except httpx.HTTPError as e: ok, status = False, repr(e)
+        # Hanya perubahan kondisi yang dicatat agar gangguan panjang tidak membanjiri log
+        if not ok and (self.healthy or not self.samples): logger.warning(f"Probe storage gagal: {status}")
+        elif ok and self.samples and not self.healthy: logger.info("Probe storage kembali berhasil.")
+        self.samples.append((ok, time.perf_counter() - started))
+        if ok: self.last_success = datetime.now()
+        else: self.last_error = status
+
+    @property
+    def healthy(self):
+        return bool(self.samples) and self.samples[-1][0]
+
+    def error_rate(self):
+        return sum(1 for ok, _ in self.samples if not ok) / len(self.samples) if self.samples else 0.0
+
+    def latency_percentiles(self, quantiles=(0.5, 0.95)):
+        latencies = sorted(latency for ok, latency in self.samples if ok)
+        if not latencies: return None
+        return [latencies[min(len(latencies) - 1, int(q * len(latencies)))] for q in quantiles]
+
+class ImageCache:
+    """Cache thumbnail di disk lokal dengan batas ukuran dan eviksi LRU (berdasarkan mtime)."""
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir; self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+
+    @staticmethod
+    def make_key(remote_file_path, file_info):
+        raw = f"{remote_file_path}|{file_info.get('DateCreated', '')}|{file_info.get('Length', '')}"
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get(self, key):
+        path = os.path.join(self.cache_dir, f"{key}.jpg")
+        try: os.utime(path); return path
+        except FileNotFoundError: return None
+
+    def put(self, key, src_path):
+        path = os.path.join(self.cache_dir, f"{key}.jpg")
+        # src_path bisa berada di filesystem lain (mis. volume cache terpisah): pindahkan dulu ke cache_dir, lalu ganti secara atomik
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp'); os.close(fd)
+        shutil.move(src_path, temp_path); os.replace(temp_path, path); self.total_bytes += os.path.getsize(path)
+        if self.total_bytes > self.max_bytes: self._evict()
+        return path
+
+    def _evict(self):
+        entries = sorted((entry for entry in os.scandir(self.cache_dir) if entry.is_file()), key=lambda e: e.stat().st_mtime)
+        self.total_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.total_bytes <= self.max_bytes: break
+            try: size = entry.stat().st_size; os.remove(entry.path); self.total_bytes -= size
+            except FileNotFoundError: continue
+
+class CategoryRegistry:
+    """Daftar kategori di memori; setiap perubahan langsung berlaku dan disimpan atomik ke config.json."""
+    DEFAULT_CATEGORIES = ["grab", "mrt", "bensin", "parkir", "lembur"]
+
+    def __init__(self, config_file):
+        self.config_file = config_file
+        try:
+            with open(config_file, 'r') as f: self._categories = json.load(f).get('commands', [])
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._categories = list(self.DEFAULT_CATEGORIES); self._save()
+
+    def __iter__(self): return iter(list(self._categories))
+    def __contains__(self, category): return category in self._categories
+    def __len__(self): return len(self._categories)
+
+    def match(self, text):
+        """Mengembalikan kategori dari teks perintah seperti '/grab' atau '/grab@NamaBot'."""
+        if not text or not text.startswith('/') or len(text) < 2: return None
+        command = text[1:].split(maxsplit=1)[0].split('@')[0].lower()
+        return command if command in self._categories else None
+
+    def add(self, category):
+        if category in self._categories: return False
+        self._categories = sorted(self._categories + [category]); self._save(); return True
+
+    def remove(self, category):
+        if category not in self._categories: return False
+        self._categories = [c for c in self._categories if c != category]; self._save(); return True
+
+    def _save(self):
+        temp_path = f"{self.config_file}.tmp"
+        with open(temp_path, 'w') as f: json.dump({'commands': sorted(set(self._categories))}, f, indent=2)
+        os.replace(temp_path, self.config_file)
+
+class CategoryCommandFilter(filters.MessageFilter):
+    def __init__(self, registry):
+        super().__init__(name='CategoryCommandFilter'); self.registry = registry
+
+    def filter(self, message):
+        return self.registry.match(message.text) is not None
+
+class JobLimitError(Exception):
+    pass
+
+class Job:
+    def __init__(self, key):
+        self.key = key; self.subscribers = []; self.task = None
+
+    async def report(self, text):
+        for progress in list(self.subscribers):
+            try: await progress(text)
+            except Exception as e: logger.debug(f"Gagal mengirim progres job {self.key}: {e}")
+
+class JobManager:
+    """Antrean pekerjaan berat dengan worker terbatas, penggabungan job identik, dan batas per pengguna."""
+    def __init__(self, max_workers=2, per_user_limit=1):
+        self.semaphore = asyncio.Semaphore(max_workers); self.per_user_limit = per_user_limit
+        self.jobs = {}; self.user_jobs = {}
+
+    async def submit(self, key, user_id, job_func, progress=None):
+        if self.user_jobs.get(user_id, 0) >= self.per_user_limit:
+            raise JobLimitError("Anda masih memiliki proses yang berjalan. Tunggu hingga selesai.")
+        # Slot dihitung sebelum await pertama agar submit bersamaan dari pengguna yang sama tidak lolos batas
+        self.user_jobs[user_id] = self.user_jobs.get(user_id, 0) + 1
+        job = self.jobs.get(key); joined = job is not None
+        if job is None:
+            job = Job(key); self.jobs[key] = job
+            job.task = asyncio.create_task(self._run(job, job_func))
+        try:
+            if progress:
+                if joined: await progress("⏳ Proses yang sama sedang berjalan, menunggu hasilnya...")
+                job.subscribers.append(progress)
+            return await asyncio.shield(job.task)
+        finally:
+            self.user_jobs[user_id] -= 1
+            if not self.user_jobs[user_id]: del self.user_jobs[user_id]
+            if progress in job.subscribers: job.subscribers.remove(progress)
+
+    async def _run(self, job, job_func):
+        try:
+            if self.semaphore.locked(): await job.report("⏳ Menunggu giliran di antrean...")
+            async with self.semaphore: return await job_func(job.report)
+        finally:
+            self.jobs.pop(job.key, None)
+
+class Ledger:
+    """Cermin lokal (SQLite) dari entri rembesan yang tersimpan di Bunny."""
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                category TEXT NOT NULL, period TEXT NOT NULL, file_name TEXT NOT NULL,
+                timestamp TEXT NOT NULL, keterangan TEXT NOT NULL, biaya INTEGER NOT NULL, created TEXT NOT NULL,
+                PRIMARY KEY (category, period, file_name)
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_period ON entries (period, category, timestamp);
+            CREATE TABLE IF NOT EXISTS synced_periods (period TEXT PRIMARY KEY, synced_at TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                category TEXT NOT NULL, period TEXT NOT NULL, file_name TEXT NOT NULL,
+                unique_id TEXT, sha256 TEXT, dhash TEXT,
+                PRIMARY KEY (category, period, file_name)
+            );
+            CREATE INDEX IF NOT EXISTS idx_fingerprints_unique_id ON fingerprints (period, unique_id);
+            CREATE INDEX IF NOT EXISTS idx_fingerprints_sha256 ON fingerprints (period, sha256);
+        """)
+        self._trackers = {}
+
+    def track_changes(self, period):
+        """Catat entri yang ditambah/dihapus pada periode selama listing storage berjalan."""
+        changes = {}; self._trackers.setdefault(period, []).append(changes); return changes
+
+    def untrack_changes(self, period, changes):
+        trackers = self._trackers.get(period, [])
+        if changes in trackers: trackers.remove(changes)
+        if not trackers: self._trackers.pop(period, None)
+
+    def _record_change(self, category, period, file_name, change):
+        for changes in self._trackers.get(period, []): changes[(category, file_name)] = change
+
+    def add_entry(self, category, period, file_name, timestamp, keterangan, biaya, created):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (category, period, file_name, timestamp, keterangan, biaya, created)
+            )
+        self._record_change(category, period, file_name, 'add')
+
+    def remove_entry(self, category, period, file_name):
+        with self.conn:
+            self.conn.execute("DELETE FROM entries WHERE category = ? AND period = ? AND file_name = ?", (category, period, file_name))
+            self.conn.execute("DELETE FROM fingerprints WHERE category = ? AND period = ? AND file_name = ?", (category, period, file_name))
+        self._record_change(category, period, file_name, 'remove')
+
+    def add_fingerprint(self, category, period, file_name, unique_id, sha256, dhash):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)", (category, period, file_name, unique_id, sha256, dhash))
+
+    def move_fingerprint(self, category, period, file_name, new_category, new_period, new_file_name):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE OR REPLACE fingerprints SET category = ?, period = ?, file_name = ? WHERE category = ? AND period = ? AND file_name = ?",
+                (new_category, new_period, new_file_name, category, period, file_name)
+            )
+
+    def find_fingerprint(self, period, unique_id=None, sha256=None):
+        """Entri periode yang masih ada dengan file_unique_id atau hash isi yang sama: (kategori, nama file, unique_id, sha256, dhash)."""
+        return self.conn.execute(
+            "SELECT f.category, f.file_name, f.unique_id, f.sha256, f.dhash FROM fingerprints f "
+            "JOIN entries e ON e.category = f.category AND e.period = f.period AND e.file_name = f.file_name "
+            "WHERE f.period = ? AND (f.unique_id = ? OR f.sha256 = ?) LIMIT 1", (period, unique_id, sha256)
+        ).fetchone()
+
+    def fingerprints(self, period):
+        return self.conn.execute(
+            "SELECT f.category, f.file_name, f.sha256, f.dhash FROM fingerprints f "
+            "JOIN entries e ON e.category = f.category AND e.period = f.period AND e.file_name = f.file_name WHERE f.period = ?", (period,)
+        ).fetchall()
+
+    def replace_period(self, period, rows, changes=None):
+        """Ganti isi periode dengan hasil listing; perubahan lokal selama listing berjalan (`changes`) tetap dipertahankan."""
+        changes = changes or {}
+        with self.conn:
+            kept = [row for row in self.conn.execute("SELECT * FROM entries WHERE period = ?", (period,)) if changes.get((row[0], row[2])) == 'add']
+            rows = [row for row in rows if changes.get((row[0], row[2])) != 'remove'] + kept
+            self.conn.execute("DELETE FROM entries WHERE period = ?", (period,))
+            self.conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.execute("INSERT OR REPLACE INTO synced_periods VALUES (?, ?)", (period, datetime.now().isoformat()))
+
+    def is_synced(self, period):
+        return self.conn.execute("SELECT 1 FROM synced_periods WHERE period = ?", (period,)).fetchone() is not None
+
+    def synced_periods(self):
+        return {period for period, in self.conn.execute("SELECT period FROM synced_periods")}
+
+    def totals(self, period):
+        return self.conn.execute(
+            "SELECT category, SUM(biaya), COUNT(*) FROM entries WHERE period = ? GROUP BY category", (period,)
+        ).fetchall()
+
+    def entries(self, period):
+        return self.conn.execute(
+            "SELECT category, file_name, timestamp, keterangan, biaya FROM entries WHERE period = ? ORDER BY category, timestamp", (period,)
+        ).fetchall()
+
 class RembesBot:
+    # Prefix storage yang dipakai bot sendiri, tidak boleh menjadi nama kategori
+    RESERVED_CATEGORIES = {'thumb', 'snapshot'}
+    EXPORT_FORMATS = ('docx', 'csv', 'xlsx', 'zip')
+    EXPORT_LAYOUT_VERSION = 2
+
     def __init__(self):
         self.config = Config()
-        self.storage = BunnyStorage(self.config.BUNNY_STORAGE_ZONE_NAME, self.config.BUNNY_ACCESS_KEY, self.config.BUNNY_REGION)
-        self.commands = self._load_commands()
+        self.storage = BunnyStorage(
+            self.config.BUNNY_STORAGE_ZONE_NAME, self.config.BUNNY_ACCESS_KEY, self.config.BUNNY_REGION,
+            pool_size=self.config.BUNNY_POOL_SIZE, timeout=self.config.BUNNY_TIMEOUT, endpoint=self.config.BUNNY_ENDPOINT,
+            connect_timeout=self.config.BUNNY_CONNECT_TIMEOUT, retries=self.config.BUNNY_RETRIES, retry_backoff=self.config.BUNNY_RETRY_BACKOFF,
+            breaker_threshold=self.config.BUNNY_BREAKER_THRESHOLD, breaker_reset=self.config.BUNNY_BREAKER_RESET
+        )
+        self.health = HealthMonitor(
+            self.storage, self.config.HEALTH_PROBE_INTERVAL, self.config.HEALTH_PROBE_TIMEOUT, self.config.HEALTH_PROBE_WINDOW
+        )
+        self.commands = CategoryRegistry(self.config.CONFIG_FILE)
+        self._builtin_commands = set()
+        self.ledger = Ledger(self.config.LEDGER_FILE)
+        self.image_pool = ProcessPoolExecutor(max_workers=self.config.IMAGE_PROCESS_WORKERS)
+        self.jobs = JobManager(self.config.JOB_WORKERS, self.config.JOB_PER_USER_LIMIT)
+        self.image_cache = ImageCache(os.path.join(self.config.CACHE_DIR, 'thumbs'), self.config.IMAGE_CACHE_MAX_MB * 1024 * 1024)
+        self.export_dir = os.path.join(self.config.CACHE_DIR, 'exports'); os.makedirs(self.export_dir, exist_ok=True)
         self.application = None
+        self.metrics_server = None; self.instance_lock = None
         self.start_time = datetime.now()
+        # Cache listing per (kategori, periode) -> (waktu kedaluwarsa, daftar file)
+        self._listing_cache = {}
+        self._listing_semaphore = asyncio.Semaphore(self.config.LIST_CONCURRENCY)
+        # Snapshot periode yang sudah ditutup tidak pernah berubah, cukup dibaca sekali
+        self._snapshots = {}
         (
             self.GET_PHOTO, self.GET_KETERANGAN, self.GET_BIAYA, self.ASK_CONTINUE,
             self.CHOOSE_DELETE_CATEGORY, self.CHOOSE_DELETE_FILE,
-            self.CHOOSE_EDIT_CATEGORY, self.CHOOSE_EDIT_FILE, self.CHOOSE_EDIT_FIELD, self.GET_NEW_VALUE
-        ) = range(10)
+            self.CHOOSE_EDIT_CATEGORY, self.CHOOSE_EDIT_FILE, self.CHOOSE_EDIT_FIELD, self.GET_NEW_VALUE,
+            self.GET_ALBUM_DETAILS
+        ) = range(11)
 
     # --- Fungsi Utilitas ---
-    def _load_commands(self):
-        try:
-            with open(self.config.CONFIG_FILE, 'r') as f: return json.load(f).get('commands', [])
-        except (FileNotFoundError, json.JSONDecodeError):
-            default_commands = ["grab", "mrt", "bensin", "parkir", "lembur"]; self._save_commands(default_commands)
-            return default_commands
-
-    def _save_commands(self, commands_list):
-        with open(self.config.CONFIG_FILE, 'w') as f: json.dump({'commands': sorted(list(set(commands_list)))}, f, indent=2)
+    def _now(self):
+        return datetime.now(ZoneInfo(self.config.TIMEZONE)).replace(tzinfo=None)
 
     def _get_current_period(self):
-        now = datetime.now(); month = now.month - 1 if now.day < 25 else now.month
+        now = self._now(); month = now.month - 1 if now.day < 25 else now.month
         year = now.year if now.month > 1 or now.day >= 25 else now.year - 1
         if month == 0: month = 12
         return f"{year}-{month:02d}", year, month
 
+    async def _list_period(self, category, period):
+        key = (category, period); cached = self._listing_cache.get(key)
+        if cached and cached[0] > time.monotonic(): return cached[1]
+        async with self._listing_semaphore:
+            files = await self.storage.list_files(f"{category}/{period}/")
+        if files is not None: self._listing_cache[key] = (time.monotonic() + self.config.LIST_CACHE_TTL, files)
+        return files
+
+    async def _list_all_categories(self, period):
+        commands = list(self.commands)
+        results = await asyncio.gather(*(self._list_period(cmd, period) for cmd in commands))
+        return dict(zip(commands, results))
+
+    def _invalidate_listing(self, category, period):
+        self._listing_cache.pop((category, period), None)
+
+    @staticmethod
+    def _display_keterangan(keterangan, limit=80):
+        # Dipotong agar satu halaman tidak melewati batas 4096 karakter Telegram
+        text = keterangan.replace('_', ' ').capitalize()
+        return text if len(text) <= limit else text[:limit - 1] + "…"
+
+    def _page_buttons(self, prefix, offset, total):
+        size = self.config.LIST_PAGE_SIZE; row = []
+        if offset > 0: row.append(InlineKeyboardButton("⬅️ Sebelumnya", callback_data=f"{prefix}{max(0, offset - size)}"))
+        if offset + size < total: row.append(InlineKeyboardButton("Berikutnya ➡️", callback_data=f"{prefix}{offset + size}"))
+        return InlineKeyboardMarkup([row]) if row else None
+
+    async def _picker_page(self, category, period, offset, prefix, title, footer):
+        """Halaman pemilih hapus/edit: (teks, tombol, {nomor: file}) untuk entri yang terlihat saja, atau None jika kosong."""
+        files = sorted((f for f in await self._list_period(category, period) or [] if not f.get('IsDirectory')), key=lambda x: x['DateCreated'])
+        if not files: return None
+        size = self.config.LIST_PAGE_SIZE; offset = max(0, min(offset, (len(files) - 1) // size * size))
+        lines = [title]; page = {}
+        for i, f in enumerate(files[offset:offset + size], offset + 1):
+            try: _, keterangan, biaya = self._parse_file_name(f['ObjectName'])
+            except (ValueError, IndexError): continue
+            lines.append(f"`{i}`. {self._display_keterangan(keterangan)} - Rp {biaya:,}")
+            page[i] = {'ObjectName': f['ObjectName'], 'DateCreated': f.get('DateCreated')}
+        lines.append(f"\nHalaman {offset // size + 1}/{(len(files) - 1) // size + 1}. {footer}")
+        return "\n".join(lines), self._page_buttons(prefix, offset, len(files)), page
+
+    def _parse_file_name(self, file_name):
+        # Format: {YYYYMMDD}_{HHMMSS}_{keterangan}_{biaya}.jpg
+        parts = file_name.replace(".jpg", "").split("_")
+        if len(parts) < 4: raise ValueError(f"Nama file tidak dikenali: {file_name}")
+        return "_".join(parts[:2]), "_".join(parts[2:-1]), int(parts[-1])
+
+    def _thumb_path(self, remote_file_path):
+        return f"thumb/{remote_file_path}"
+
+    async def _store_entry(self, bot, category, period, file_name, photo_file_id=None, placeholder_text=None, photo_unique_id=None):
+        """Ambil foto (atau buat placeholder), normalisasi di process pool, lalu unggah gambar dan thumbnail-nya.
+
+        Mengembalikan (berhasil, duplikat); duplikat berisi (kategori, nama file, 'identik'/'mirip') jika foto yang sama sudah ada di periode ini.
+        """
+        remote_path = f"{category}/{period}/{file_name}"
+        # Foto Telegram yang sama (file_unique_id) tetap disimpan sebagai objek sendiri; duplikatnya hanya dilaporkan
+        existing = self.ledger.find_fingerprint(period, unique_id=photo_unique_id) if photo_unique_id else None
+        with tempfile.TemporaryDirectory() as temp_dir:
+            raw_path, image_path, thumb_path = (os.path.join(temp_dir, name) for name in ('raw.jpg', 'image.jpg', 'thumb.jpg'))
+            sha256 = dhash = None
+            if photo_file_id:
+                photo_file = await bot.get_file(photo_file_id); await photo_file.download_to_drive(raw_path)
+                sha256 = await asyncio.to_thread(file_sha256, raw_path)
+                existing = existing or self.ledger.find_fingerprint(period, sha256=sha256)
+            else: self._create_placeholder_image(placeholder_text, raw_path)
+            try:
+                _, _, dhash = await asyncio.get_running_loop().run_in_executor(
+                    self.image_pool, normalize_image, raw_path, image_path, thumb_path, self.config.INGEST_MAX_SIZE,
+                    self.config.INGEST_QUALITY, self.config.EXPORT_THUMB_SIZE, self.config.EXPORT_THUMB_QUALITY
+                )
+            except Exception as e:
+                logger.warning(f"Normalisasi gambar gagal, mengunggah file asli: {e}"); image_path, thumb_path = raw_path, None
+            if not await self.storage.upload_file(image_path, remote_path): return False, None
+            if thumb_path and not await self.storage.upload_file(thumb_path, self._thumb_path(remote_path)):
+                logger.warning(f"Gagal mengunggah thumbnail untuk '{remote_path}'.")
+        similar = None if existing else self._find_similar(period, dhash)
+        duplicate = (existing[0], existing[1], 'identik') if existing else (*similar, 'mirip') if similar else None
+        self._invalidate_listing(category, period); self._ledger_record(category, period, file_name)
+        if photo_file_id: self.ledger.add_fingerprint(category, period, file_name, photo_unique_id, sha256, dhash)
+        return True, duplicate
+
+    def _find_similar(self, period, dhash):
+        if dhash is None or self.config.DEDUPE_DHASH_DISTANCE < 0: return None
+        target = int(dhash, 16)
+        for category, file_name, _, other in self.ledger.fingerprints(period):
+            if other and bin(target ^ int(other, 16)).count('1') <= self.config.DEDUPE_DHASH_DISTANCE: return category, file_name
+        return None
+
+    def _duplicate_note(self, duplicate):
+        category, file_name, kind = duplicate
+        try: keterangan = self._display_keterangan(self._parse_file_name(file_name)[1])
+        except (ValueError, IndexError): keterangan = file_name
+        return f"⚠️ Foto ini {kind} dengan data {category.upper()} \"{keterangan}\" yang sudah tersimpan di periode ini."
+
+    def _ledger_record(self, category, period, file_name, created=None):
+        timestamp, keterangan, biaya = self._parse_file_name(file_name)
+        self.ledger.add_entry(category, period, file_name, timestamp, keterangan, biaya, created or datetime.now().isoformat())
+
+    async def _reconcile_ledger(self, period):
+        for cmd in self.commands: self._invalidate_listing(cmd, period)
+        # Entri yang disimpan/dihapus selama listing berjalan belum tentu ikut di hasil listing;
+        # catat perubahannya supaya replace_period tidak menimpanya dengan data lama.
+        changes = self.ledger.track_changes(period)
+        try: listings = await self._list_all_categories(period)
+        finally: self.ledger.untrack_changes(period, changes)
+        rows = []
+        if any(files is None for files in listings.values()):
+            logger.error(f"Sinkronisasi ledger periode {period} gagal: listing storage tidak lengkap."); return False
+        for cmd, files in listings.items():
+            for file_info in files:
+                if file_info.get('IsDirectory'): continue
+                try:
+                    timestamp, keterangan, biaya = self._parse_file_name(file_info['ObjectName'])
+                    rows.append((cmd, period, file_info['ObjectName'], timestamp, keterangan, biaya, file_info.get('DateCreated', '')))
+                except (ValueError, IndexError): continue
+        self.ledger.replace_period(period, rows, changes)
+        logger.info(f"Ledger periode {period} disinkronkan: {len(rows)} entri."); return True
+
+    async def _ensure_ledger(self, period):
+        if not self.ledger.is_synced(period): await self._reconcile_ledger(period)
+
+    async def _prepare_export_image(self, remote_file_path, file_info, temp_dir, semaphore):
+        cache_key = self.image_cache.make_key(remote_file_path, file_info)
+        cached = self.image_cache.get(cache_key)
+        if cached: return cached
+        local_path = os.path.join(temp_dir, remote_file_path.replace('/', '_')); thumb_path = f"{local_path}.thumb.jpg"
+        async with semaphore:
+            # Thumbnail hasil ingest sudah berukuran sel tabel; file asli hanya untuk data lama
+            if await self.storage.download_file(self._thumb_path(remote_file_path), thumb_path):
+                return self.image_cache.put(cache_key, thumb_path)
+            if not await self.storage.download_file(remote_file_path, local_path): return None
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self.image_pool, make_thumbnail, local_path, thumb_path, self.config.EXPORT_THUMB_SIZE, self.config.EXPORT_THUMB_QUALITY
+            )
+            return self.image_cache.put(cache_key, thumb_path)
+        except Exception as e:
+            logger.error(f"Gagal membuat thumbnail {remote_file_path}: {e}"); return None
+
+    async def _prepare_export_images(self, items, temp_dir, content_keys=None):
+        # Entri dengan isi identik (hash konten sama) cukup diunduh sekali; docx juga menyimpan gambar identik sebagai satu part
+        content_keys = content_keys or {}; canonical, unique = {}, []
+        for path, info in items:
+            key = content_keys.get(path) or path
+            if key not in canonical: canonical[key] = path; unique.append((path, info))
+        semaphore = asyncio.Semaphore(self.config.EXPORT_DOWNLOAD_WORKERS)
+        results = await asyncio.gather(*(self._prepare_export_image(path, info, temp_dir, semaphore) for path, info in unique))
+        prepared = {path: result for (path, _), result in zip(unique, results)}
+        return {path: prepared[canonical[content_keys.get(path) or path]] for path, _ in items}
+
+    def _listing_fingerprint(self, listings):
+        manifest = [
+            [cmd] + sorted([f['ObjectName'], f.get('DateCreated', ''), f.get('Length', 0)] for f in files or [])
+            for cmd, files in listings.items()
+        ]
+        # Versi tata letak ikut di-hash agar laporan cache dari format lama tidak dipakai lagi
+        return hashlib.sha256(json.dumps([self.EXPORT_LAYOUT_VERSION, manifest]).encode()).hexdigest()[:16]
+
+    async def _build_export(self, period, year, month, listings, progress=None):
+        """Membangun laporan .docx; hasil di-cache berdasarkan fingerprint listing periode."""
+        if not any(listings.values()): return None
+        export_path = os.path.join(self.export_dir, f"Laporan_Rembesan_{period}_{self._listing_fingerprint(listings)}.docx")
+        if os.path.exists(export_path): return export_path
+        month_name = datetime(year, month, 1).strftime("%B")
+        # Direktori kerja di dalam CACHE_DIR agar os.replace ke export_dir/cache thumbnail tetap di filesystem yang sama
+        temp_dir = tempfile.mkdtemp(dir=self.config.CACHE_DIR, prefix='.build-')
+        try:
+            document = Document(); document.add_heading(f'Laporan Rembesan - {month_name} {year}', level=1)
+            document.add_paragraph(f"Dibuat pada: {self._now().strftime('%d %B %Y, %H:%M:%S')}")
+            grand_total = 0
+            items = [(f"{cmd}/{period}/{f['ObjectName']}", f) for cmd, files in listings.items() if files for f in files]
+            if progress: await progress(f"🖼️ Menyiapkan {len(items)} bukti...")
+            with metrics.timer('export_phase_duration_seconds', phase='download'):
+                content_keys = {f"{cmd}/{period}/{file_name}": sha256 for cmd, file_name, sha256, _ in self.ledger.fingerprints(period)}
+                images = await self._prepare_export_images(items, temp_dir, content_keys)
+            build_started = time.perf_counter()
+            for cmd, files in listings.items():
+                remote_path = f"{cmd}/{period}/"
+                if not files: continue
+                category_total = 0
+                document.add_heading(cmd.upper(), level=2)
+                table = document.add_table(rows=1, cols=4); table.style = 'Table Grid'
+                hdr_cells = table.rows[0].cells; hdr_cells[0].text = 'No.'; hdr_cells[1].text = 'Tanggal & Waktu'; hdr_cells[2].text = 'Keterangan & Bukti'; hdr_cells[3].text = 'Biaya (Rp)'
+                sorted_files = sorted(files, key=lambda x: x['DateCreated'])
+                for item_number, file_info in enumerate(sorted_files, 1):
+                    try:
+                        file_name = file_info['ObjectName']; timestamp_str, keterangan, nilai_int = self._parse_file_name(file_name)
+                        keterangan = keterangan.replace('_', ' ').capitalize(); category_total += nilai_int
+                        try: tanggal_formatted = datetime.strptime(timestamp_str, '%Y%m%d_%H%M%S').strftime('%d %b %Y, %H:%M')
+                        except ValueError: tanggal_formatted = timestamp_str
+                        row_cells = table.add_row().cells; row_cells[0].text = str(item_number); row_cells[1].text = tanggal_formatted
+                        p = row_cells[2].paragraphs[0]; p.add_run(keterangan).bold = True
+                        local_image_path = images.get(f"{remote_path}{file_name}")
+                        if local_image_path: p.add_run('\n').add_picture(local_image_path, width=Inches(1.5))
+                        row_cells[3].text = f"{nilai_int:,}"
+                    except Exception as e: logger.error(f"Gagal memproses file {file_name} untuk ekspor: {e}")
+                total_row = table.add_row(); merged_cell = total_row.cells[0].merge(total_row.cells[2])
+                merged_cell.text = f"Total {cmd.upper()}"; merged_cell.paragraphs[0].runs[0].bold = True
+                total_value_cell = total_row.cells[3]; total_value_cell.text = f"Rp {category_total:,}"; total_value_cell.paragraphs[0].runs[0].bold = True
+                grand_total += category_total
+            document.add_heading('Ringkasan Total', level=2)
+            document.add_paragraph().add_run(f"Grand Total: Rp {grand_total:,}").bold = True
+            temp_export_path = os.path.join(temp_dir, 'export.docx')
+            await asyncio.to_thread(document.save, temp_export_path)
+            metrics.observe('export_phase_duration_seconds', time.perf_counter() - build_started, phase='build')
+            # Laporan lama periode ini sudah tidak valid
+            for entry in os.scandir(self.export_dir):
+                if entry.name.startswith(f"Laporan_Rembesan_{period}_"): os.remove(entry.path)
+            os.replace(temp_export_path, export_path)
+        finally:
+            shutil.rmtree(temp_dir)
+        return export_path
+
+    def _previous_period(self, period):
+        year, month = map(int, period.split('-'))
+        return f"{year - 1}-12" if month == 1 else f"{year}-{month - 1:02d}"
+
+    def _is_closed(self, period):
+        return period < self._get_current_period()[0]
+
+    def _parse_period_arg(self, context):
+        if not context.args: return self._get_current_period()[0]
+        period = context.args[0]
+        return period if re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", period) else None
+
+    async def close_period(self, period):
+        """Membekukan periode yang sudah lewat menjadi satu snapshot JSON di storage."""
+        if not await self._reconcile_ledger(period): return None
+        categories = {}
+        for category, file_name, timestamp, keterangan, biaya in self.ledger.entries(period):
+            data = categories.setdefault(category, {'total': 0, 'count': 0, 'entries': []})
+            data['total'] += biaya; data['count'] += 1
+            data['entries'].append({'file_name': file_name, 'timestamp': timestamp, 'keterangan': keterangan, 'biaya': biaya})
+        snapshot = {
+            'period': period, 'closed_at': datetime.now().isoformat(), 'categories': categories,
+            'grand_total': sum(data['total'] for data in categories.values())
+        }
+        if not await self.storage.upload_bytes(json.dumps(snapshot).encode(), f"snapshot/{period}.json"):
+            logger.error(f"Gagal menyimpan snapshot periode {period}."); return None
+        self._snapshots[period] = snapshot; logger.info(f"Periode {period} ditutup: {len(categories)} kategori.")
+        return snapshot
+
+    async def _load_snapshot(self, period):
+        """Snapshot periode tertutup, atau None jika belum ada; pembuatannya diserahkan ke job penutupan atau /sinkron."""
+        if period in self._snapshots: return self._snapshots[period]
+        data = await self.storage.download_bytes(f"snapshot/{period}.json")
+        if data is None: return None
+        self._snapshots[period] = json.loads(data); return self._snapshots[period]
+
+    async def _known_periods(self):
+        """Periode yang punya snapshot di storage atau pernah disinkronkan ke ledger (satu listing, tanpa menulis)."""
+        snapshots = await self.storage.list_files("snapshot/") or []
+        return {f['ObjectName'][:-len('.json')] for f in snapshots if f['ObjectName'].endswith('.json')} | self.ledger.synced_periods()
+
+    async def _period_entries(self, period):
+        """Entri periode (kategori, nama file, timestamp, keterangan, biaya): snapshot untuk periode tertutup, ledger untuk periode aktif."""
+        if self._is_closed(period):
+            snapshot = await self._load_snapshot(period)
+            if snapshot is not None:
+                return [
+                    (category, e['file_name'], e['timestamp'], e['keterangan'], e['biaya'])
+                    for category, data in snapshot['categories'].items() for e in data['entries']
+                ]
+        await self._ensure_ledger(period)
+        return self.ledger.entries(period)
+
+    async def _period_totals(self, period):
+        if self._is_closed(period):
+            snapshot = await self._load_snapshot(period)
+            if snapshot is not None: return {category: data['total'] for category, data in snapshot['categories'].items()}
+        await self._ensure_ledger(period)
+        return {category: total for category, total, _ in self.ledger.totals(period)}
+
+    async def _close_previous_period(self):
+        # Dijalankan tanggal 25 menurut zona waktu scheduler, yang juga dipakai _get_current_period
+        await self.close_period(self._previous_period(self._get_current_period()[0]))
+
     def _format_uptime(self, duration):
         days, rem = divmod(duration.total_seconds(), 86400); hours, rem = divmod(rem, 3600); minutes, _ = divmod(rem, 60)
         return f"{int(days)} hari, {int(hours)} jam, {int(minutes)} menit"
@@ -135,87 +1169,214 @@ class RembesBot:
 
     # --- Handler Perintah Standar ---
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        self.commands = self._load_commands()
         command_list_str = "".join([f"`{cmd}` " for cmd in self.commands])
         welcome_message = (
             "🤖 *Bot Rembesan v3.1!*\n\n"
             f"Kategori tersedia: {command_list_str}\n\n"
             "*Perintah Utama:*\n"
             "`/status` - Cek status bot\n"
-            "`/summary` - Lihat ringkasan total biaya\n"
-            "`/list` - Lihat rincian data\n"
-            "`/export` - Ekspor data ke Word\n"
+            "`/summary [YYYY-MM]` - Lihat ringkasan total biaya\n"
+            "`/list [YYYY-MM]` - Lihat rincian data\n"
+            "`/ytd [YYYY]` - Lihat total tahun berjalan\n"
+            "`/export [docx|csv|xlsx|zip]` - Ekspor data (Word, CSV, Excel, atau zip foto asli)\n"
             "`/hapus` - Hapus data\n"
             "`/edit` - Edit data\n\n"
             "*Manajemen:*\n"
             "`/tambah_kategori` | `/hapus_kategori`\n"
+            "`/sinkron` - Sinkronkan ledger lokal dengan cloud\n"
+            "`/pindah` - Pindahkan data antar kategori/periode\n"
             "`/batal` - Membatalkan proses"
         )
         await update.message.reply_text(welcome_message, parse_mode='Markdown')
 
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         uptime = self._format_uptime(datetime.now() - self.start_time)
-        bunny_status = "✅ Terhubung" if self.storage.check_connection() else "❌ Gagal terhubung"
+        breaker, health = self.storage.breaker, self.health
+        if breaker.state == 'open': bunny_status = f"⚠️ Terganggu (dicoba lagi dalam {breaker.retry_in()} detik)"
+        elif not health.samples: bunny_status = "⏳ Belum diperiksa"
+        else: bunny_status = "✅ Terhubung" if health.healthy else "❌ Gagal terhubung"
+        if breaker.state == 'half-open': bunny_status += " (pemulihan)"
+        percentiles = health.latency_percentiles(); region = (self.config.BUNNY_REGION or 'de').upper()
+        latency = f"p50 {percentiles[0] * 1000:.0f} ms, p95 {percentiles[1] * 1000:.0f} ms" if percentiles else "-"
+        last_success = f"{int((datetime.now() - health.last_success).total_seconds())} detik lalu" if health.last_success else "belum pernah"
         period, _, _ = self._get_current_period()
         status_message = (
             f"🤖 *Status Bot*\n\n"
             f"🟢 Status: *Online*\n"
             f"⏱️ Waktu Aktif: *{uptime}*\n"
             f"☁️ Koneksi Storage: *{bunny_status}*\n"
+            f"📶 Latensi Storage ({region}): *{latency}*\n"
+            f"📉 Error Rate: *{health.error_rate():.0%}* dari {len(health.samples)} probe terakhir\n"
+            f"🕒 Probe Sukses Terakhir: *{last_success}*\n"
             f"🗂️ Jumlah Kategori: *{len(self.commands)}*\n"
             f"🗓️ Periode Aktif: *{period}*"
         )
         await update.message.reply_text(status_message, parse_mode='Markdown')
         
     async def summary_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        period, _, _ = self._get_current_period()
-        summary = {}; grand_total = 0
+        period = self._parse_period_arg(context)
+        if not period: await update.message.reply_text("Format: `/summary [YYYY-MM]`", parse_mode='Markdown'); return
+        totals = await self._period_totals(period)
+        summary = {cmd: totals[cmd] for cmd in self.commands if cmd in totals}; grand_total = sum(summary.values())
         message = [f"📊 *Ringkasan Biaya Periode {period}*"]
-        for cmd in self.commands:
-            remote_path = f"{cmd}/{period}/"; files = self.storage.list_files(remote_path)
-            if files:
-                try:
-                    total = sum(int(f['ObjectName'].replace(".jpg","").split("_")[-1]) for f in files)
-                    summary[cmd] = total; grand_total += total
-                except (ValueError, IndexError): continue
         if not summary:
             await update.message.reply_text("Tidak ada data untuk ditampilkan."); return
         for cmd, total in summary.items(): message.append(f"- {cmd.upper()}: `Rp {total:,}`")
         message.append(f"\n*Grand Total: `Rp {grand_total:,}`*")
         await update.message.reply_text("\n".join(message), parse_mode='Markdown')
 
+    async def ytd_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        current_period = self._get_current_period()[0]; year = context.args[0] if context.args else current_period[:4]
+        if not re.fullmatch(r"\d{4}", year): await update.message.reply_text("Format: `/ytd [YYYY]`", parse_mode='Markdown'); return
+        # Hanya periode yang datanya sudah diketahui; periode lain akan memicu listing penuh per kategori
+        known = await self._known_periods() if year <= current_period[:4] else set()
+        candidates = [f"{year}-{month:02d}" for month in range(1, 13) if f"{year}-{month:02d}" <= current_period]
+        periods = [period for period in candidates if period == current_period or period in known]
+        skipped = len(candidates) - len(periods)
+        if not periods: await update.message.reply_text("Tidak ada data untuk ditampilkan."); return
+        await update.message.reply_text(f"⏳ Menghitung total tahun {year}...")
+        results = await asyncio.gather(*(self._period_totals(period) for period in periods))
+        totals = {}
+        for period_totals in results:
+            for category, total in period_totals.items(): totals[category] = totals.get(category, 0) + total
+        if not totals: await update.message.reply_text("Tidak ada data untuk ditampilkan."); return
+        message = [f"📈 *Total Tahun {year}* ({periods[0]} s/d {periods[-1]})"]
+        message.extend(f"- {period}: `Rp {sum(t.values()):,}`" for period, t in zip(periods, results) if t)
+        message.append("")
+        message.extend(f"- {category.upper()}: `Rp {total:,}`" for category, total in sorted(totals.items()))
+        message.append(f"\n*Grand Total: `Rp {sum(totals.values()):,}`*")
+        if skipped: message.append(f"\nℹ️ {skipped} periode belum tersinkron dan tidak dihitung. Gunakan `/sinkron YYYY-MM`.")
+        await update.message.reply_text("\n".join(message), parse_mode='Markdown')
+
+    async def metrics_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Tanpa ADMIN_IDS tidak ada yang dianggap admin
+        if update.effective_user.id not in self.config.ADMIN_IDS:
+            await update.message.reply_text("⛔ Perintah ini khusus admin."); return
+        sections = [
+            ("Storage", 'bunny_request_duration_seconds', 'operation'), ("Handler", 'handler_duration_seconds', 'handler'),
+            ("Ekspor", 'export_phase_duration_seconds', 'phase'),
+        ]
+        message = ["📈 *Metrik Bot* (jumlah | p50 | p99)"]
+        for title, name, label in sections:
+            rows = metrics.summaries(name)
+            if not rows: continue
+            message.append(f"\n*{title}*")
+            for labels, count, p50, p99 in rows:
+                state = f" `{labels['state']}`" if labels.get('state', '-') != '-' else ""
+                message.append(f"`{labels[label]}`{state}: {count} | {p50 * 1000:.0f} ms | {p99 * 1000:.0f} ms")
+        if len(message) == 1: message.append("Belum ada data.")
+        await update.message.reply_text("\n".join(message), parse_mode='Markdown')
+
+    async def _move_entries(self, src_category, src_period, dst_category, dst_period):
+        self._invalidate_listing(src_category, src_period)
+        files = [f for f in await self._list_period(src_category, src_period) or [] if not f.get('IsDirectory')]
+        pairs = [(f"{src_category}/{src_period}/{f['ObjectName']}", f"{dst_category}/{dst_period}/{f['ObjectName']}") for f in files]
+        results = [state for state, _ in await self.storage.move_files(pairs)]
+        # Entri lama belum tentu punya thumbnail, jadi sumber yang hilang bukan error
+        await self.storage.move_files([(self._thumb_path(src), self._thumb_path(dst)) for (src, dst), state in zip(pairs, results) if state == BunnyStorage.MOVED], missing_ok=True)
+        for (src, dst), state in zip(pairs, results):
+            if state == BunnyStorage.COPIED: await self.storage.copy_file(self._thumb_path(src), self._thumb_path(dst), missing_ok=True)
+        for file_info, state in zip(files, results):
+            if state == BunnyStorage.FAILED: continue
+            # COPIED: file asal gagal dihapus, jadi ledger mencatat entri di kedua lokasi seperti isi storage
+            if state == BunnyStorage.MOVED:
+                self.ledger.move_fingerprint(src_category, src_period, file_info['ObjectName'], dst_category, dst_period, file_info['ObjectName'])
+                self.ledger.remove_entry(src_category, src_period, file_info['ObjectName'])
+            try: self._ledger_record(dst_category, dst_period, file_info['ObjectName'], file_info.get('DateCreated'))
+            except (ValueError, IndexError): continue
+        self._invalidate_listing(src_category, src_period); self._invalidate_listing(dst_category, dst_period)
+        moved, copied = results.count(BunnyStorage.MOVED), results.count(BunnyStorage.COPIED)
+        for period in {src_period, dst_period}:
+            if (moved or copied) and self._is_closed(period): await self.close_period(period)
+        return moved, copied, len(files) - moved - copied
+
+    def _parse_location(self, arg):
+        category, _, period = arg.lower().partition('/')
+        period = period or self._get_current_period()[0]
+        if category not in self.commands or not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", period): return None
+        return category, period
+
+    async def _start_job(self, update, context, key, job_func, deliver, status_text):
+        """Menjalankan job di latar belakang; progres ditampilkan lewat satu pesan status."""
+        message = await update.message.reply_text(status_text)
+        chat_id, user_id, bot = update.effective_chat.id, update.effective_user.id, context.bot
+        async def progress(text): await bot.edit_message_text(chat_id=chat_id, message_id=message.message_id, text=text)
+        async def run():
+            try: await deliver(await self.jobs.submit(key, user_id, job_func, progress), progress, message)
+            except JobLimitError as e: await progress(f"⚠️ {e}")
+            except Exception as e:
+                logger.error(f"Job {key} gagal: {e}"); await progress(f"❌ Terjadi kesalahan: {e}")
+        context.application.create_task(run(), update=update)
+
+    async def move_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        locations = [self._parse_location(arg) for arg in context.args or []]
+        if len(locations) != 2 or None in locations or locations[0] == locations[1]:
+            await update.message.reply_text("Format: `/pindah <kategori>[/YYYY-MM] <kategori>[/YYYY-MM]`", parse_mode='Markdown'); return
+        (src_category, src_period), (dst_category, dst_period) = locations
+        async def deliver(result, progress, message):
+            moved, copied, failed = result
+            await progress(
+                f"✅ {moved} data dipindahkan." + (f" ❌ {failed} data gagal dipindahkan." if failed else "")
+                + (f"\n⚠️ {copied} data tersalin ke {dst_category.upper()} {dst_period}, tetapi file asalnya gagal dihapus sehingga tercatat di kedua lokasi." if copied else "")
+            )
+        await self._start_job(
+            update, context, ('move', src_category, src_period, dst_category, dst_period),
+            lambda report: self._move_entries(src_category, src_period, dst_category, dst_period), deliver,
+            f"⏳ Memindahkan data {src_category.upper()} {src_period} ke {dst_category.upper()} {dst_period}..."
+        )
+
+    async def sync_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        period = context.args[0] if context.args else self._get_current_period()[0]
+        if not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", period):
+            await update.message.reply_text("Format: `/sinkron [YYYY-MM]`", parse_mode='Markdown'); return
+        async def deliver(success, progress, message):
+            await progress(f"✅ Ledger periode {period} berhasil disinkronkan." if success else "❌ Gagal membaca storage. Ledger tidak diubah.")
+        async def sync(report):
+            if self._is_closed(period): return await self.close_period(period) is not None
+            return await self._reconcile_ledger(period)
+        await self._start_job(update, context, ('sync', period), sync, deliver, f"⏳ Menyinkronkan ledger periode {period}...")
+
     async def add_category_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             new_cmd = context.args[0].lower().strip()
             if not new_cmd.isalpha(): await update.message.reply_text("❌ Nama kategori hanya boleh berisi huruf."); return
+            if new_cmd in self.RESERVED_CATEGORIES or new_cmd in self._builtin_commands: await update.message.reply_text(f"❌ Nama '{new_cmd}' dipakai oleh sistem."); return
             if new_cmd in self.commands: await update.message.reply_text(f"⚠️ Kategori '{new_cmd}' sudah ada."); return
-            self.commands.append(new_cmd); self._save_commands(self.commands)
-            await update.message.reply_text(f"✅ Kategori '{new_cmd}' ditambahkan!\n\n‼️ *PENTING: Mohon restart bot agar perintah baru bisa digunakan.*", parse_mode='Markdown')
+            self.commands.add(new_cmd)
+            await update.message.reply_text(f"✅ Kategori '{new_cmd}' ditambahkan! Perintah `/{new_cmd}` sudah bisa digunakan.", parse_mode='Markdown')
         except IndexError: await update.message.reply_text("Format: `/tambah_kategori <nama_kategori>`")
 
     async def remove_category_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             cmd_to_remove = context.args[0].lower().strip()
             if cmd_to_remove not in self.commands: await update.message.reply_text(f"⚠️ Kategori '{cmd_to_remove}' tidak ditemukan."); return
-            self.commands.remove(cmd_to_remove); self._save_commands(self.commands)
-            await update.message.reply_text(f"✅ Kategori '{cmd_to_remove}' dihapus!\n\n‼️ *PENTING: Mohon restart bot untuk menerapkan perubahan.*", parse_mode='Markdown')
+            self.commands.remove(cmd_to_remove)
+            await update.message.reply_text(f"✅ Kategori '{cmd_to_remove}' dihapus!")
         except IndexError: await update.message.reply_text("Format: `/hapus_kategori <nama_kategori>`")
 
     # --- Alur Percakapan Tambah Data ---
     async def start_reimbursement_flow(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        command = update.message.text[1:].lower(); context.user_data['category'] = command
+        command = self.commands.match(update.message.text); context.user_data['category'] = command
         if command == 'lembur':
             context.user_data['no_photo'] = True
             await update.message.reply_text("Baik, masukkan keterangan untuk *LEMBUR*.\n\nKetik /batal untuk membatalkan.", parse_mode='Markdown')
             return self.GET_KETERANGAN
         else:
             context.user_data['no_photo'] = False
-            await update.message.reply_text(f"Baik, silakan kirim foto/bukti untuk *{command.upper()}*.\n\nKetik /batal.", parse_mode='Markdown')
+            await update.message.reply_text(f"Baik, silakan kirim foto/bukti untuk *{command.upper()}*. Bisa juga beberapa foto sekaligus (album).\n\nKetik /batal.", parse_mode='Markdown')
             return self.GET_PHOTO
 
     async def get_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        photo_file = await update.message.photo[-1].get_file(); context.user_data['photo_file_id'] = photo_file.file_id
-        await update.message.reply_text("✅ Foto diterima. Sekarang, masukkan keterangan singkat."); return self.GET_KETERANGAN
+        if update.message.media_group_id:
+            # Foto album datang sebagai update terpisah; kumpulkan dulu, minta rincian setelah album lengkap
+            photo = update.message.photo[-1]; album = context.user_data.setdefault('album', []); album.append((photo.file_id, photo.file_unique_id))
+            if len(album) == 1: context.application.create_task(self._prompt_album_details(update.message, context.user_data), update=update)
+            return self.GET_ALBUM_DETAILS
+        photo = update.message.photo[-1]; context.user_data['photo_file_id'] = photo.file_id; context.user_data['photo_unique_id'] = photo.file_unique_id
+        text = "✅ Foto diterima. Sekarang, masukkan keterangan singkat."
+        existing = self.ledger.find_fingerprint(self._get_current_period()[0], unique_id=photo.file_unique_id)
+        if existing: text = f"{self._duplicate_note((existing[0], existing[1], 'identik'))}\nLanjutkan jika memang ingin menyimpannya lagi, atau /batal.\n\n{text}"
+        await update.message.reply_text(text); return self.GET_KETERANGAN
 
     async def get_keterangan(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['keterangan'] = update.message.text
@@ -229,32 +1390,92 @@ class RembesBot:
         try:
             category = context.user_data['category']; keterangan = context.user_data['keterangan']
             period, _, _ = self._get_current_period(); safe_keterangan = re.sub(r'[^\w\-_\.]', '_', keterangan)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S'); file_name = f"{timestamp}_{safe_keterangan}_{biaya}.jpg"
-            remote_path = f"{category}/{period}/{file_name}"
-            with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as temp_file:
-                if context.user_data.get('no_photo'):
-                    self._create_placeholder_image(f"{keterangan}\nRp {int(biaya):,}", temp_file.name)
+            timestamp = self._now().strftime('%Y%m%d_%H%M%S'); file_name = f"{timestamp}_{safe_keterangan}_{biaya}.jpg"
+            no_photo = context.user_data.get('no_photo')
+            stored, duplicate = await self._store_entry(
+                context.bot, category, period, file_name, photo_file_id=None if no_photo else context.user_data['photo_file_id'],
+                placeholder_text=f"{keterangan}\nRp {int(biaya):,}", photo_unique_id=context.user_data.get('photo_unique_id')
+            )
+            if stored:
+                if duplicate: await update.message.reply_text(self._duplicate_note(duplicate))
+                if not no_photo:
+                    if self.config.GROUP_CHAT_ID: await context.bot.send_photo(self.config.GROUP_CHAT_ID, context.user_data['photo_file_id'], caption=f"☁️ Data Baru:\n`{category.upper()}` | `{safe_keterangan}` | `Rp {int(biaya):,}`", parse_mode='Markdown')
                 else:
-                    photo_file = await context.bot.get_file(context.user_data['photo_file_id'])
-                    await photo_file.download_to_drive(temp_file.name)
-                if self.storage.upload_file(temp_file.name, remote_path):
-                    if not context.user_data.get('no_photo'):
-                        if self.config.GROUP_CHAT_ID: await context.bot.send_photo(self.config.GROUP_CHAT_ID, context.user_data['photo_file_id'], caption=f"☁️ Data Baru:\n`{category.upper()}` | `{safe_keterangan}` | `Rp {int(biaya):,}`", parse_mode='Markdown')
-                    else:
-                        if self.config.GROUP_CHAT_ID: await context.bot.send_message(self.config.GROUP_CHAT_ID, f"☁️ Data Lembur (Tanpa Foto):\n`{category.upper()}` | `{safe_keterangan}` | `Rp {int(biaya):,}`", parse_mode='Markdown')
-                    buttons = [[InlineKeyboardButton("Ya", callback_data="continue_yes"), InlineKeyboardButton("Tidak", callback_data="continue_no")]]
-                    await update.message.reply_text(f"✅ Data berhasil disimpan. Ingin menambahkan data lagi untuk kategori *{category.upper()}*?", reply_markup=InlineKeyboardMarkup(buttons), parse_mode='Markdown')
-                    return self.ASK_CONTINUE
-                else: await update.message.reply_text("❌ Gagal mengunggah file ke cloud."); context.user_data.clear(); return ConversationHandler.END
-            os.unlink(temp_file.name)
+                    if self.config.GROUP_CHAT_ID: await context.bot.send_message(self.config.GROUP_CHAT_ID, f"☁️ Data Lembur (Tanpa Foto):\n`{category.upper()}` | `{safe_keterangan}` | `Rp {int(biaya):,}`", parse_mode='Markdown')
+                buttons = [[InlineKeyboardButton("Ya", callback_data="continue_yes"), InlineKeyboardButton("Tidak", callback_data="continue_no")]]
+                await update.message.reply_text(f"✅ Data berhasil disimpan. Ingin menambahkan data lagi untuk kategori *{category.upper()}*?", reply_markup=InlineKeyboardMarkup(buttons), parse_mode='Markdown')
+                return self.ASK_CONTINUE
+            else: await update.message.reply_text("❌ Gagal mengunggah file ke cloud."); context.user_data.clear(); return ConversationHandler.END
         except Exception as e:
             logger.error(f"Kesalahan saat menyimpan data: {e}"); await update.message.reply_text("❌ Terjadi kesalahan internal saat menyimpan.")
             context.user_data.clear(); return ConversationHandler.END
 
+    async def _prompt_album_details(self, message, user_data):
+        await asyncio.sleep(self.config.ALBUM_COLLECT_SECONDS)
+        count = len(user_data.get('album', []))
+        await message.reply_text(
+            f"📸 *{count} foto diterima.* Kirim keterangan dan biaya untuk setiap foto, satu baris per foto sesuai urutan album:\n\n"
+            "`Parkir mall 5000`\n`Tol dalam kota 12000`\n\nKetik /batal untuk membatalkan.", parse_mode='Markdown'
+        )
+
+    def _parse_album_lines(self, text, count):
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        if len(lines) != count: return None, f"❌ Jumlah baris ({len(lines)}) tidak sama dengan jumlah foto ({count}). Silakan kirim ulang."
+        entries = []
+        for i, line in enumerate(lines, 1):
+            keterangan, _, biaya = line.rpartition(' '); biaya = biaya.replace('.', '').replace(',', '')
+            if not keterangan.strip() or not biaya.isdigit(): return None, f"❌ Baris {i} harus berformat `<keterangan> <biaya>`. Silakan kirim ulang."
+            entries.append((keterangan.strip(), biaya))
+        return entries, None
+
+    async def get_album_details(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        album = context.user_data.get('album', [])
+        entries, error = self._parse_album_lines(update.message.text, len(album))
+        if error: await update.message.reply_text(error, parse_mode='Markdown'); return self.GET_ALBUM_DETAILS
+        await update.message.reply_text(f"⏳ Mengunggah {len(album)} data sekaligus...")
+        try:
+            category = context.user_data['category']; period, _, _ = self._get_current_period(); now = self._now()
+            semaphore = asyncio.Semaphore(self.config.UPLOAD_CONCURRENCY)
+            async def store(index, file_id, unique_id, keterangan, biaya):
+                # Timestamp digeser per detik agar nama file unik dan urutan album terjaga
+                timestamp = (now + timedelta(seconds=index)).strftime('%Y%m%d_%H%M%S'); safe_keterangan = re.sub(r'[^\w\-_\.]', '_', keterangan)
+                file_name = f"{timestamp}_{safe_keterangan}_{biaya}.jpg"
+                async with semaphore: return await self._store_entry(context.bot, category, period, file_name, photo_file_id=file_id, photo_unique_id=unique_id)
+            results = await asyncio.gather(
+                *(store(i, file_id, unique_id, keterangan, biaya) for i, ((file_id, unique_id), (keterangan, biaya)) in enumerate(zip(album, entries))),
+                return_exceptions=True
+            )
+            # Unggahan sudah selesai; album dilepas sekarang agar kiriman ulang tidak mengunggah semuanya lagi
+            context.user_data.pop('album', None)
+            lines, saved, total = [], [], 0
+            for (file_id, _), (keterangan, biaya), result in zip(album, entries, results):
+                if not isinstance(result, Exception) and result[0]:
+                    saved.append((file_id, keterangan, biaya)); total += int(biaya); lines.append(f"✅ {keterangan} - Rp {int(biaya):,}")
+                    if result[1]: lines.append(f"   {self._duplicate_note(result[1])}")
+                else:
+                    if isinstance(result, Exception): logger.error(f"Gagal menyimpan foto album '{keterangan}': {result}")
+                    lines.append(f"❌ {keterangan} - gagal diunggah")
+            if saved and self.config.GROUP_CHAT_ID:
+                caption = f"☁️ {len(saved)} Data Baru {category.upper()}:\n" + "\n".join(f"{k} | Rp {int(b):,}" for _, k, b in saved)
+                try:
+                    for start in range(0, len(saved), 10):
+                        media = [InputMediaPhoto(file_id, caption=caption[:1024] if start == 0 and i == 0 else None) for i, (file_id, _, _) in enumerate(saved[start:start + 10])]
+                        await context.bot.send_media_group(self.config.GROUP_CHAT_ID, media)
+                except Exception as e: logger.warning(f"Gagal mengirim notifikasi album ke grup: {e}")
+            buttons = [[InlineKeyboardButton("Ya", callback_data="continue_yes"), InlineKeyboardButton("Tidak", callback_data="continue_no")]]
+            await update.message.reply_text(
+                f"{len(saved)}/{len(album)} data tersimpan (Total: Rp {total:,})\n" + "\n".join(lines)
+                + f"\n\nIngin menambahkan data lagi untuk kategori {category.upper()}?", reply_markup=InlineKeyboardMarkup(buttons)
+            )
+            return self.ASK_CONTINUE
+        except Exception as e:
+            logger.error(f"Kesalahan saat menyimpan album: {e}"); await update.message.reply_text("❌ Terjadi kesalahan internal saat menyimpan.")
+            context.user_data.clear(); return ConversationHandler.END
+
     async def ask_continue(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query; await query.answer()
         category = context.user_data['category']
-        context.user_data.pop('photo_file_id', None); context.user_data.pop('keterangan', None)
+        for key in ('photo_file_id', 'photo_unique_id', 'keterangan', 'album'): context.user_data.pop(key, None)
         if query.data == 'continue_yes':
             if context.user_data.get('no_photo'):
                 await query.edit_message_text(f"Baik, masukkan keterangan lagi untuk *{category.upper()}*.", parse_mode='Markdown'); return self.GET_KETERANGAN
@@ -272,40 +1493,45 @@ class RembesBot:
 
     async def choose_delete_category(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query; await query.answer(); category = query.data.split('_')[1]
-        context.user_data['delete_category'] = category; period, _, _ = self._get_current_period()
-        remote_path = f"{category}/{period}/"; files = self.storage.list_files(remote_path)
-        if not files:
-            await query.edit_message_text(f"Tidak ada file untuk dihapus di kategori *{category.upper()}*.", parse_mode='Markdown')
+        period, _, _ = self._get_current_period()
+        context.user_data['delete_category'] = category; context.user_data['delete_period'] = period
+        return await self._show_delete_page(query, context, 0)
+
+    async def delete_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query; await query.answer()
+        return await self._show_delete_page(query, context, int(query.data.split('_')[1]))
+
+    async def _show_delete_page(self, query, context, offset):
+        category, period = context.user_data.get('delete_category'), context.user_data.get('delete_period')
+        page = await self._picker_page(
+            category, period, offset, "delpg_", f"*Pilih file yang ingin dihapus dari {category.upper()}:*\n",
+            "Ketik nomor file yang ingin Anda hapus, atau /batal."
+        ) if category else None
+        if not page:
+            await query.edit_message_text(f"Tidak ada file untuk dihapus di kategori *{(category or '').upper()}*.", parse_mode='Markdown')
             context.user_data.clear(); return ConversationHandler.END
-        context.user_data['deletable_files'] = []
-        message_lines = [f"*Pilih file yang ingin dihapus dari {category.upper()}:*\n"]
-        sorted_files = sorted(files, key=lambda x: x['DateCreated'])
-        for i, file_info in enumerate(sorted_files, 1):
-            try:
-                file_name = file_info['ObjectName']; parts = file_name.replace(".jpg", "").split("_")
-                keterangan = " ".join(parts[1:-1]).capitalize(); nilai = parts[-1]
-                message_lines.append(f"`{i}`. {keterangan} - Rp {int(nilai):,}")
-                context.user_data['deletable_files'].append(file_name)
-            except (ValueError, IndexError): continue
-        message_lines.append("\nKetik nomor file yang ingin Anda hapus, atau /batal.")
-        await query.edit_message_text("\n".join(message_lines), parse_mode='Markdown')
+        text, markup, context.user_data['delete_page'] = page
+        await query.edit_message_text(text, parse_mode='Markdown', reply_markup=markup)
         return self.CHOOSE_DELETE_FILE
 
     async def choose_delete_file(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
-            choice = int(update.message.text); deletable_files = context.user_data.get('deletable_files', [])
-            category = context.user_data.get('delete_category')
-            if not category or not deletable_files:
+            choice = int(update.message.text); page = context.user_data.get('delete_page', {})
+            category, period = context.user_data.get('delete_category'), context.user_data.get('delete_period')
+            if not category or not page:
                 await update.message.reply_text("Sesi telah berakhir. Mulai lagi dengan /hapus."); context.user_data.clear(); return ConversationHandler.END
-            if 0 < choice <= len(deletable_files):
-                file_to_delete = deletable_files[choice - 1]; period, _, _ = self._get_current_period()
+            if choice in page:
+                file_to_delete = page[choice]['ObjectName']
                 remote_path = f"{category}/{period}/{file_to_delete}"
                 await update.message.reply_text(f"⏳ Menghapus file `{file_to_delete}`...", parse_mode='Markdown')
-                success, message = self.storage.delete_file(remote_path)
+                success, message = await self.storage.delete_file(remote_path)
+                self._invalidate_listing(category, period)
+                if success:
+                    self.ledger.remove_entry(category, period, file_to_delete); await self.storage.delete_file(self._thumb_path(remote_path))
                 await update.message.reply_text(message)
                 context.user_data.clear(); return ConversationHandler.END
             else:
-                await update.message.reply_text("Nomor tidak valid. Silakan pilih nomor dari daftar."); return self.CHOOSE_DELETE_FILE
+                await update.message.reply_text("Nomor tidak valid. Silakan pilih nomor dari halaman yang sedang ditampilkan."); return self.CHOOSE_DELETE_FILE
         except ValueError:
             await update.message.reply_text("Input tidak valid. Harap masukkan nomor saja."); return self.CHOOSE_DELETE_FILE
         except Exception as e:
@@ -320,26 +1546,33 @@ class RembesBot:
 
     async def choose_edit_category(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query; await query.answer(); category = query.data.split('_')[1]
-        context.user_data['edit_category'] = category; period, _, _ = self._get_current_period()
-        remote_path = f"{category}/{period}/"; files = self.storage.list_files(remote_path)
-        if not files:
-            await query.edit_message_text(f"Tidak ada data untuk diedit di *{category.upper()}*.", parse_mode='Markdown'); context.user_data.clear(); return ConversationHandler.END
-        context.user_data['editable_files'] = sorted(files, key=lambda x: x['DateCreated'])
-        message = [f"*Pilih data dari {category.upper()} yang ingin diedit:*\n"]
-        for i, f in enumerate(context.user_data['editable_files'], 1):
-            try:
-                parts=f['ObjectName'].replace('.jpg','').split('_'); ket= " ".join(parts[1:-1]).capitalize(); nilai=parts[-1]
-                message.append(f"`{i}`. {ket} - Rp {int(nilai):,}")
-            except (ValueError, IndexError): continue
-        message.append("\nKetik nomor data yang ingin diedit, atau /batal.")
-        await query.edit_message_text("\n".join(message), parse_mode='Markdown'); return self.CHOOSE_EDIT_FILE
+        period, _, _ = self._get_current_period()
+        context.user_data['edit_category'] = category; context.user_data['edit_period'] = period
+        return await self._show_edit_page(query, context, 0)
+
+    async def edit_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query; await query.answer()
+        return await self._show_edit_page(query, context, int(query.data.split('_')[1]))
+
+    async def _show_edit_page(self, query, context, offset):
+        category, period = context.user_data.get('edit_category'), context.user_data.get('edit_period')
+        page = await self._picker_page(
+            category, period, offset, "editpg_", f"*Pilih data dari {category.upper()} yang ingin diedit:*\n",
+            "Ketik nomor data yang ingin diedit, atau /batal."
+        ) if category else None
+        if not page:
+            await query.edit_message_text(f"Tidak ada data untuk diedit di *{(category or '').upper()}*.", parse_mode='Markdown')
+            context.user_data.clear(); return ConversationHandler.END
+        text, markup, context.user_data['edit_page'] = page
+        await query.edit_message_text(text, parse_mode='Markdown', reply_markup=markup)
+        return self.CHOOSE_EDIT_FILE
 
     async def choose_edit_file(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try: choice = int(update.message.text)
         except ValueError: await update.message.reply_text("Harap masukkan nomor."); return self.CHOOSE_EDIT_FILE
-        if not 0 < choice <= len(context.user_data['editable_files']):
+        if choice not in context.user_data.get('edit_page', {}):
             await update.message.reply_text("Nomor tidak valid."); return self.CHOOSE_EDIT_FILE
-        context.user_data['edit_file_index'] = choice - 1
+        context.user_data['edit_file'] = context.user_data.pop('edit_page')[choice]
         buttons = [[InlineKeyboardButton("Keterangan", callback_data="editfield_ket"), InlineKeyboardButton("Biaya", callback_data="editfield_bia")]]
         await update.message.reply_text("Apa yang ingin Anda ubah?", reply_markup=InlineKeyboardMarkup(buttons)); return self.CHOOSE_EDIT_FIELD
 
@@ -354,28 +1587,30 @@ class RembesBot:
             await update.message.reply_text("Biaya harus angka. Masukkan lagi."); return self.GET_NEW_VALUE
         await update.message.reply_text("⏳ Menyimpan perubahan...")
         try:
-            category = context.user_data['edit_category']; period, _, _ = self._get_current_period()
-            original_file = context.user_data['editable_files'][context.user_data['edit_file_index']]
+            category, period = context.user_data['edit_category'], context.user_data['edit_period']
+            original_file = context.user_data['edit_file']
             original_filename = original_file['ObjectName']
-            parts = original_filename.replace(".jpg","").split("_")
-            timestamp, original_keterangan, original_biaya = parts[0], "_".join(parts[1:-1]), parts[-1]
+            timestamp, original_keterangan, original_biaya = self._parse_file_name(original_filename)
             new_keterangan = re.sub(r'[^\w\-_\.]', '_', new_value) if field_to_edit == 'ket' else original_keterangan
             new_biaya = new_value if field_to_edit == 'bia' else original_biaya
             new_filename = f"{timestamp}_{new_keterangan}_{new_biaya}.jpg"
             if new_filename == original_filename:
                 await update.message.reply_text("Tidak ada perubahan. Proses dihentikan."); context.user_data.clear(); return ConversationHandler.END
-            with tempfile.TemporaryDirectory() as temp_dir:
-                local_path = os.path.join(temp_dir, original_filename)
-                original_remote_path = f"{category}/{period}/{original_filename}"
-                if self.storage.download_file(original_remote_path, local_path):
-                    success, msg = self.storage.delete_file(original_remote_path)
-                    if success:
-                        new_remote_path = f"{category}/{period}/{new_filename}"
-                        if self.storage.upload_file(local_path, new_remote_path):
-                            await update.message.reply_text("✅ Perubahan berhasil disimpan.")
-                        else: await update.message.reply_text("❌ Gagal mengunggah file baru.")
-                    else: await update.message.reply_text(f"❌ Gagal menghapus file lama: {msg}")
-                else: await update.message.reply_text("❌ Gagal mengunduh file untuk diedit.")
+            original_remote_path = f"{category}/{period}/{original_filename}"; new_remote_path = f"{category}/{period}/{new_filename}"
+            state, msg = await self.storage.move_file(original_remote_path, new_remote_path)
+            self._invalidate_listing(category, period)
+            if state == BunnyStorage.MOVED:
+                await self.storage.move_file(self._thumb_path(original_remote_path), self._thumb_path(new_remote_path), missing_ok=True)
+                self.ledger.move_fingerprint(category, period, original_filename, category, period, new_filename)
+                self.ledger.remove_entry(category, period, original_filename)
+                self._ledger_record(category, period, new_filename, original_file.get('DateCreated'))
+                await update.message.reply_text("✅ Perubahan berhasil disimpan.")
+            elif state == BunnyStorage.COPIED:
+                # Data lama masih ada di storage, jadi ledger tetap mencatat keduanya
+                await self.storage.copy_file(self._thumb_path(original_remote_path), self._thumb_path(new_remote_path), missing_ok=True)
+                self._ledger_record(category, period, new_filename, original_file.get('DateCreated'))
+                await update.message.reply_text(f"{msg}\nData lama dan data baru sama-sama tersimpan. Hapus data lama lewat /hapus.")
+            else: await update.message.reply_text(f"❌ Gagal menyimpan perubahan. {msg}")
         except Exception as e:
             logger.error(f"Kesalahan saat edit data: {e}"); await update.message.reply_text("❌ Terjadi kesalahan internal.")
         finally:
@@ -390,138 +1625,310 @@ class RembesBot:
         return ConversationHandler.END
 
     async def list_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        period, year, month = self._get_current_period(); month_name = datetime(year, month, 1).strftime("%B")
-        messages = [f"📋 *Data Rembesan Cloud - {month_name} {year}:*\n"]; total_data, total_biaya = 0, 0
-        for cmd in self.commands:
-            remote_path = f"{cmd}/{period}/"; files = self.storage.list_files(remote_path)
-            if files:
-                cmd_data, cmd_total = [], 0
-                for file_info in sorted(files, key=lambda x: x['DateCreated']):
-                    try:
-                        file_name = file_info['ObjectName']; parts = file_name.replace(".jpg", "").split("_")
-                        nilai, keterangan = parts[-1], " ".join(parts[1:-1]).capitalize(); nilai_int = int(nilai)
-                        cmd_data.append(f"- {keterangan}: Rp {nilai_int:,}"); total_data += 1
-                        total_biaya += nilai_int; cmd_total += nilai_int
-                    except (ValueError, IndexError): continue
-                if cmd_data:
-                    messages.append(f"*{cmd.upper()}* (Total: Rp {cmd_total:,}):"); messages.extend(cmd_data); messages.append("")
-        if total_data > 0:
-            messages.append(f"*Total Transaksi: {total_data}*"); messages.append(f"*Total Biaya: Rp {total_biaya:,}*")
-        else: messages.append("Belum ada data di cloud untuk periode ini.")
-        await update.message.reply_text("\n".join(messages), parse_mode='Markdown')
+        period = self._parse_period_arg(context)
+        if not period: await update.message.reply_text("Format: `/list [YYYY-MM]`", parse_mode='Markdown'); return
+        text, markup = await self._render_list_page(period, 0)
+        await update.message.reply_text(text, parse_mode='Markdown', reply_markup=markup)
 
-    async def export_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        message = await update.message.reply_text("⏳ Memulai proses ekspor dari cloud...")
-        temp_dir = tempfile.mkdtemp()
+    async def list_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query; await query.answer()
+        _, period, offset = query.data.split('_')
+        text, markup = await self._render_list_page(period, int(offset))
+        await query.edit_message_text(text, parse_mode='Markdown', reply_markup=markup)
+
+    async def _render_list_page(self, period, offset):
+        """Satu halaman /list dari ledger/snapshot; hanya entri yang terlihat yang dirender."""
+        year, month = map(int, period.split('-')); month_name = datetime(year, month, 1).strftime("%B")
+        order = {cmd: i for i, cmd in enumerate(self.commands)}
+        entries = sorted((e for e in await self._period_entries(period) if e[0] in order), key=lambda e: (order[e[0]], e[2]))
+        header = f"📋 *Data Rembesan Cloud - {month_name} {year}:*\n"
+        if not entries: return header + "\nBelum ada data di cloud untuk periode ini.", None
+        totals = {}
+        for category, _, _, _, biaya in entries: totals[category] = totals.get(category, 0) + biaya
+        size = self.config.LIST_PAGE_SIZE; offset = max(0, min(offset, (len(entries) - 1) // size * size))
+        messages = [header]; current = None
+        for category, _, _, keterangan, biaya in entries[offset:offset + size]:
+            if category != current:
+                if current: messages.append("")
+                suffix = "" if current or offset == 0 or entries[offset - 1][0] != category else " (lanjutan)"
+                messages.append(f"*{category.upper()}*{suffix} (Total: Rp {totals[category]:,}):"); current = category
+            messages.append(f"- {self._display_keterangan(keterangan)}: Rp {biaya:,}")
+        messages.append(f"\n*Total Transaksi: {len(entries)}*"); messages.append(f"*Total Biaya: Rp {sum(totals.values()):,}*")
+        messages.append(f"Halaman {offset // size + 1}/{(len(entries) - 1) // size + 1}")
+        return "\n".join(messages), self._page_buttons(f"listpg_{period}_", offset, len(entries))
+
+    async def _export_job(self, period, year, month, report):
+        await report("🔍 Mengambil data kategori...")
+        with metrics.timer('export_phase_duration_seconds', phase='listing'):
+            listings = await self._list_all_categories(period)
+        return await self._build_export(period, year, month, listings, report)
+
+    async def _table_export(self, period, fmt, report):
+        """CSV/XLSX langsung dari ledger atau snapshot, tanpa mengunduh gambar."""
+        entries = await self._period_entries(period)
+        if not entries: return None
+        rows = []
+        for category, _, timestamp, keterangan, biaya in sorted(entries, key=lambda e: (e[0], e[2])):
+            try: tanggal = datetime.strptime(timestamp, '%Y%m%d_%H%M%S')
+            except ValueError: continue
+            rows.append((category.upper(), tanggal, keterangan.replace('_', ' ').capitalize(), biaya))
+        await report(f"🧾 Menyusun {len(rows)} baris...")
+        with metrics.timer('export_phase_duration_seconds', phase='build'):
+            return await asyncio.to_thread(render_csv if fmt == 'csv' else render_xlsx, rows)
+
+    async def _zip_export(self, period, report):
+        """Arsip zip foto asli; unduhan berjalan paralel dan hasilnya di-cache selama isi periode tidak berubah."""
+        entries = await self._period_entries(period)
+        if not entries: return None
+        fingerprint = hashlib.sha256(json.dumps([list(e) for e in entries]).encode()).hexdigest()[:16]
+        zip_path = os.path.join(self.export_dir, f"Bukti_Rembesan_{period}_{fingerprint}.zip")
+        if os.path.exists(zip_path): return zip_path
+        await report(f"📦 Mengunduh {len(entries)} bukti asli...")
+        temp_dir = tempfile.mkdtemp(dir=self.config.CACHE_DIR, prefix='.build-'); semaphore = asyncio.Semaphore(self.config.EXPORT_DOWNLOAD_WORKERS)
+        async def download(category, file_name):
+            local_path = os.path.join(temp_dir, f"{category}_{file_name}")
+            async with semaphore: return local_path if await self.storage.download_file(f"{category}/{period}/{file_name}", local_path) else None
         try:
-            period, year, month = self._get_current_period(); month_name = datetime(year, month, 1).strftime("%B")
-            document = Document(); document.add_heading(f'Laporan Rembesan - {month_name} {year}', level=1)
-            document.add_paragraph(f"Dibuat pada: {datetime.now().strftime('%d %B %Y, %H:%M:%S')}")
-            grand_total, has_any_data = 0, False
-            await context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=message.message_id, text="🔍 Mengambil data kategori...")
-            for cmd in self.commands:
-                remote_path = f"{cmd}/{period}/"; files = self.storage.list_files(remote_path)
-                if not files: continue
-                has_any_data, category_total = True, 0
-                await context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=message.message_id, text=f"📄 Memproses kategori: {cmd.upper()}...")
-                document.add_heading(cmd.upper(), level=2)
-                table = document.add_table(rows=1, cols=4); table.style = 'Table Grid'
-                hdr_cells = table.rows[0].cells; hdr_cells[0].text = 'No.'; hdr_cells[1].text = 'Tanggal & Waktu'; hdr_cells[2].text = 'Keterangan & Bukti'; hdr_cells[3].text = 'Biaya (Rp)'
-                sorted_files = sorted(files, key=lambda x: x['DateCreated'])
-                for item_number, file_info in enumerate(sorted_files, 1):
-                    try:
-                        file_name = file_info['ObjectName']; parts = file_name.replace(".jpg", "").split("_")
-                        timestamp_str, nilai_str, keterangan = parts[0], parts[-1], " ".join(parts[1:-1]).capitalize()
-                        nilai_int = int(nilai_str); category_total += nilai_int
-                        try: tanggal_formatted = datetime.strptime(timestamp_str, '%Y%m%d_%H%M%S').strftime('%d %b %Y, %H:%M')
-                        except ValueError: tanggal_formatted = timestamp_str
-                        row_cells = table.add_row().cells; row_cells[0].text = str(item_number); row_cells[1].text = tanggal_formatted
-                        p = row_cells[2].paragraphs[0]; p.add_run(keterangan).bold = True
-                        local_image_path = os.path.join(temp_dir, file_name)
-                        if self.storage.download_file(f"{remote_path}{file_name}", local_image_path):
-                            p.add_run('\n').add_picture(local_image_path, width=Inches(1.5))
-                        row_cells[3].text = f"{nilai_int:,}"
-                    except Exception as e: logger.error(f"Gagal memproses file {file_name} untuk ekspor: {e}")
-                total_row = table.add_row(); merged_cell = total_row.cells[0].merge(total_row.cells[2])
-                merged_cell.text = f"Total {cmd.upper()}"; merged_cell.paragraphs[0].runs[0].bold = True
-                total_value_cell = total_row.cells[3]; total_value_cell.text = f"Rp {category_total:,}"; total_value_cell.paragraphs[0].runs[0].bold = True
-                grand_total += category_total
-            if not has_any_data:
-                await context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=message.message_id, text="ℹ️ Tidak ada data untuk diekspor.")
-                return
-            document.add_heading('Ringkasan Total', level=2)
-            document.add_paragraph().add_run(f"Grand Total: Rp {grand_total:,}").bold = True
-            export_path = os.path.join(temp_dir, f'Laporan_Rembesan_{year}_{month:02d}.docx')
-            document.save(export_path)
-            await context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=message.message_id, text="✅ Ekspor berhasil! Mengirim dokumen...")
-            await context.bot.send_document(chat_id=update.effective_chat.id, document=open(export_path, 'rb'))
-            await context.bot.delete_message(chat_id=update.effective_chat.id, message_id=message.message_id)
-        except Exception as e:
-            logger.error(f"Kesalahan fatal saat ekspor data: {e}"); await context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=message.message_id, text=f"❌ Terjadi kesalahan: {e}")
+            with metrics.timer('export_phase_duration_seconds', phase='download'):
+                paths = await asyncio.gather(*(download(category, file_name) for category, file_name, _, _, _ in entries))
+            def write_zip(target):
+                with zipfile.ZipFile(target, 'w', zipfile.ZIP_STORED) as archive:
+                    for (category, file_name, _, _, _), local_path in zip(entries, paths):
+                        if local_path: archive.write(local_path, f"{category}/{file_name}")
+            temp_zip = os.path.join(temp_dir, 'bukti.zip')
+            with metrics.timer('export_phase_duration_seconds', phase='build'): await asyncio.to_thread(write_zip, temp_zip)
+            missing = paths.count(None)
+            if missing: logger.warning(f"{missing} bukti periode {period} gagal diunduh untuk arsip zip.")
+            for entry in os.scandir(self.export_dir):
+                if entry.name.startswith(f"Bukti_Rembesan_{period}_"): os.remove(entry.path)
+            os.replace(temp_zip, zip_path)
         finally:
             shutil.rmtree(temp_dir)
+        return zip_path
+
+    async def export_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        fmt = context.args[0].lower() if context.args else 'docx'
+        if fmt not in self.EXPORT_FORMATS:
+            await update.message.reply_text("Format: `/export [docx|csv|xlsx|zip]`", parse_mode='Markdown'); return
+        period, year, month = self._get_current_period(); chat_id = update.effective_chat.id
+        jobs = {
+            'docx': lambda report: self._export_job(period, year, month, report),
+            'csv': lambda report: self._table_export(period, 'csv', report), 'xlsx': lambda report: self._table_export(period, 'xlsx', report),
+            'zip': lambda report: self._zip_export(period, report),
+        }
+        filename = f"{'Bukti' if fmt == 'zip' else 'Laporan'}_Rembesan_{year}_{month:02d}.{fmt}"
+        async def deliver(result, progress, message):
+            if not result:
+                await progress("ℹ️ Tidak ada data untuk diekspor."); return
+            size = len(result) if isinstance(result, bytes) else os.path.getsize(result)
+            if size > self.config.EXPORT_MAX_UPLOAD_MB * 1024 * 1024:
+                await progress(f"⚠️ File ekspor ({size / 1024 / 1024:.0f} MB) melebihi batas unggah Telegram. Gunakan format csv atau xlsx."); return
+            await progress("✅ Ekspor berhasil! Mengirim dokumen...")
+            with metrics.timer('export_phase_duration_seconds', phase='send'):
+                if isinstance(result, bytes): await context.bot.send_document(chat_id=chat_id, document=result, filename=filename)
+                else:
+                    with open(result, 'rb') as f: await context.bot.send_document(chat_id=chat_id, document=f, filename=filename)
+            await context.bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+        await self._start_job(update, context, ('export', period, fmt), jobs[fmt], deliver, "⏳ Memulai proses ekspor dari cloud...")
 
     # --- Otomatisasi & Menjalankan Bot ---
     async def post_init(self, application: Application):
         """Menjalankan scheduler setelah aplikasi bot siap."""
-        scheduler = AsyncIOScheduler(timezone="Asia/Jakarta")
+        scheduler = AsyncIOScheduler(timezone=self.config.TIMEZONE)
         scheduler.add_job(self.send_reminder, 'cron', day=22, hour=9)
+        scheduler.add_job(self._close_previous_period, 'cron', day=25, hour=1)
+        if 1 <= self.config.PREBUILD_START_DAY <= 24:
+            scheduler.add_job(self._prebuild_reports, 'cron', day=f"{self.config.PREBUILD_START_DAY}-24", hour=self.config.PREBUILD_HOUR, kwargs={'full': True})
+            if self.config.PREBUILD_INTERVAL_MINUTES > 0:
+                scheduler.add_job(self._prebuild_reports, 'interval', minutes=self.config.PREBUILD_INTERVAL_MINUTES)
         scheduler.start()
         logger.info("Scheduler untuk pengingat otomatis telah dimulai.")
+        self.health.start()
+        # /metrics hanya disajikan di port terpisah, tidak di listener webhook yang terbuka ke internet
+        if self.config.METRICS_PORT:
+            self.metrics_server = HttpServer(self.config.WEBHOOK_LISTEN, self.config.METRICS_PORT)
+            self.metrics_server.route('GET', '/metrics', self._metrics_handler); self.metrics_server.route('GET', '/healthz', self._health_handler)
+            await self.metrics_server.start()
+
+    async def post_shutdown(self, application: Application):
+        """Menutup pool koneksi storage saat bot berhenti."""
+        if self.metrics_server: await self.metrics_server.stop()
+        await self.health.stop(); await self.storage.close(); self.image_pool.shutdown(wait=False, cancel_futures=True)
 
     async def send_reminder(self):
         period, _, _ = self._get_current_period()
-        message = (
-            f"🔔 *PENGINGAT REMBESAN* 🔔\n\n"
-            f"Batas akhir pengajuan rembesan untuk periode *{period}* adalah tanggal 24 bulan ini.\n\n"
-            "Mohon segera unggah semua bukti pembayaran Anda. Terima kasih!"
-        )
         if self.config.GROUP_CHAT_ID:
             try:
+                totals = await self._period_totals(period)
+                lines = [f"- {cmd.upper()}: `Rp {totals[cmd]:,}`" for cmd in self.commands if cmd in totals]
+                totals_text = "*Total sementara:*\n" + "\n".join(lines) + f"\n*Grand Total: `Rp {sum(totals.values()):,}`*\n\n" if lines else ""
+                message = (
+                    f"🔔 *PENGINGAT REMBESAN* 🔔\n\n"
+                    f"Batas akhir pengajuan rembesan untuk periode *{period}* adalah tanggal 24 bulan ini.\n\n"
+                    f"{totals_text}Mohon segera unggah semua bukti pembayaran Anda. Terima kasih!"
+                )
                 await self.application.bot.send_message(chat_id=self.config.GROUP_CHAT_ID, text=message, parse_mode='Markdown')
                 logger.info("Pesan pengingat berhasil dikirim.")
             except Exception as e:
                 logger.error(f"Gagal mengirim pesan pengingat: {e}")
 
+    async def _prebuild_reports(self, full=False):
+        """Memanaskan ringkasan (ledger) dan laporan .docx periode aktif agar permintaan di hari tenggat dilayani dari cache."""
+        if not self.config.PREBUILD_START_DAY <= self._now().day <= 24: return
+        period, year, month = self._get_current_period(); started = time.perf_counter()
+        # Build malam mencocokkan ulang ledger dengan storage; refresh berkala cukup memakai ledger yang ada.
+        # Laporan .docx hanya dibangun ulang jika listing berubah, dan thumbnail lama diambil dari cache disk.
+        if full: await self._reconcile_ledger(period)
+        else: await self._ensure_ledger(period)
+        try:
+            export_path = await self.jobs.submit(
+                ('export', period, 'docx'), 'scheduler', lambda report: self._export_job(period, year, month, report)
+            )
+        except JobLimitError: logger.info(f"Pra-bangun periode {period} sebelumnya masih berjalan."); return
+        except Exception as e:
+            logger.error(f"Pra-bangun laporan periode {period} gagal: {e}"); return
+        logger.info(f"Laporan periode {period} dipra-bangun dalam {time.perf_counter() - started:.1f} dtk ({export_path or 'tidak ada data'}).")
+
+    async def _webhook_handler(self, headers, body):
+        if self.config.WEBHOOK_SECRET and headers.get('x-telegram-bot-api-secret-token') != self.config.WEBHOOK_SECRET:
+            return 403, 'text/plain', b'Forbidden'
+        await self.application.update_queue.put(Update.de_json(json.loads(body), self.application.bot))
+        return 200, 'text/plain', b'OK'
+
+    async def _health_handler(self, headers, body):
+        healthy = self.application is not None and self.application.running
+        payload = {'status': 'ok' if healthy else 'starting', 'uptime_seconds': int((datetime.now() - self.start_time).total_seconds())}
+        return (200 if healthy else 503), 'application/json', json.dumps(payload).encode()
+
+    async def _metrics_handler(self, headers, body):
+        return 200, 'text/plain; version=0.0.4', metrics.render().encode()
+
+    async def _run_webhook(self):
+        server = HttpServer(self.config.WEBHOOK_LISTEN, self.config.WEBHOOK_PORT)
+        server.route('POST', self.config.WEBHOOK_PATH, self._webhook_handler); server.route('GET', '/healthz', self._health_handler)
+        stop_event = asyncio.Event(); loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM): loop.add_signal_handler(sig, stop_event.set)
+        async with self.application:
+            await self.post_init(self.application); await self.application.start()
+            await self.application.bot.set_webhook(
+                url=self.config.WEBHOOK_URL.rstrip('/') + self.config.WEBHOOK_PATH, allowed_updates=Update.ALL_TYPES,
+                secret_token=self.config.WEBHOOK_SECRET or None
+            )
+            await server.start()
+            try: await stop_event.wait()
+            finally:
+                await server.stop(); await self.application.stop()
+        await self.post_shutdown(self.application)
+
+    def _timed(self, callback, state):
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            status = 'ok'; started = time.perf_counter()
+            text = getattr(update.effective_message, 'text', None) or ''
+            user_data = context.user_data if context.user_data is not None else {}
+            current_category = lambda: user_data.get('category') or user_data.get('delete_category') or user_data.get('edit_category')
+            fields = {
+                'user': getattr(update.effective_user, 'id', None), 'handler': callback.__name__, 'state': state,
+                'command': text.split()[0].split('@')[0] if text.startswith('/') else None, 'category': current_category(),
+            }
+            token = log_context.set(fields)
+            try:
+                with metrics.timer('handler_duration_seconds', handler=callback.__name__, state=state): return await callback(update, context)
+            except Exception: status = 'error'; raise
+            finally:
+                metrics.inc('handler_calls_total', handler=callback.__name__, state=state, status=status)
+                # Kategori bisa baru dipilih di dalam handler ini
+                fields['category'] = fields['category'] or current_category(); duration_ms = round((time.perf_counter() - started) * 1000, 1)
+                logger.info(f"Handler {callback.__name__} selesai ({status}, {duration_ms} ms)", extra={'status': status, 'duration_ms': duration_ms})
+                log_context.reset(token)
+        return wrapper
+
+    def _instrument_handlers(self):
+        state_names = {value: name for name, value in vars(self).items() if name.isupper() and isinstance(value, int)}
+        for handler in self.application.handlers[0]:
+            if isinstance(handler, ConversationHandler):
+                groups = [('entry', handler.entry_points), ('fallback', handler.fallbacks)]
+                groups += [(state_names.get(state, str(state)), handlers) for state, handlers in handler.states.items()]
+            else: groups = [('-', [handler])]
+            for state, handlers in groups:
+                for h in handlers: h.callback = self._timed(h.callback, state)
+
+    def _acquire_instance_lock(self):
+        """Kunci eksklusif (transaksi SQLite yang ditahan selama proses hidup) di samping file ledger.
+
+        Menolak proses kedua yang memakai ledger yang sama, mis. replika tambahan di belakang load balancer
+        pada host/volume yang sama; replika di host lain tetap harus dicegah lewat konfigurasi deployment.
+        """
+        lock = sqlite3.connect(self.config.LEDGER_FILE + '.lock', timeout=0, isolation_level=None, check_same_thread=False)
+        try: lock.execute("BEGIN EXCLUSIVE")
+        except sqlite3.OperationalError: lock.close(); return None
+        return lock
+
     def run(self):
         if not all([self.config.TOKEN, self.config.BUNNY_STORAGE_ZONE_NAME, self.config.BUNNY_ACCESS_KEY]):
             logger.critical("TOKEN atau kredensial BUNNY tidak lengkap!"); return
-        self.application = ApplicationBuilder().token(self.config.TOKEN).post_init(self.post_init).build()
+        self.instance_lock = self._acquire_instance_lock()
+        if self.instance_lock is None:
+            logger.critical(f"Proses bot lain sudah memakai ledger {self.config.LEDGER_FILE}! Bot hanya mendukung satu replika."); return
+        self.application = (
+            ApplicationBuilder().token(self.config.TOKEN).concurrent_updates(self.config.CONCURRENT_UPDATES)
+            .post_init(self.post_init).post_shutdown(self.post_shutdown).build()
+        )
 
         add_conv = ConversationHandler(
-            entry_points=[CommandHandler(cmd, self.start_reimbursement_flow) for cmd in self.commands],
+            entry_points=[MessageHandler(filters.COMMAND & CategoryCommandFilter(self.commands), self.start_reimbursement_flow)],
             states={
                 self.GET_PHOTO: [MessageHandler(filters.PHOTO, self.get_photo)],
                 self.GET_KETERANGAN: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.get_keterangan)],
                 self.GET_BIAYA: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.get_biaya_and_save)],
                 self.ASK_CONTINUE: [CallbackQueryHandler(self.ask_continue, pattern="^continue_")],
-            }, fallbacks=[CommandHandler("batal", self.cancel)], per_message=True
+                self.GET_ALBUM_DETAILS: [
+                    MessageHandler(filters.PHOTO, self.get_photo), MessageHandler(filters.TEXT & ~filters.COMMAND, self.get_album_details)
+                ],
+            }, fallbacks=[CommandHandler("batal", self.cancel)]
         )
         delete_conv = ConversationHandler(
             entry_points=[CommandHandler("hapus", self.start_delete_flow)],
             states={
                 self.CHOOSE_DELETE_CATEGORY: [CallbackQueryHandler(self.choose_delete_category, pattern="^delcat_")],
-                self.CHOOSE_DELETE_FILE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.choose_delete_file)],
-            }, fallbacks=[CommandHandler("batal", self.cancel)], per_message=True
+                self.CHOOSE_DELETE_FILE: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.choose_delete_file), CallbackQueryHandler(self.delete_page, pattern="^delpg_")
+                ],
+            }, fallbacks=[CommandHandler("batal", self.cancel)]
         )
         edit_conv = ConversationHandler(
             entry_points=[CommandHandler("edit", self.start_edit_flow)],
             states={
                 self.CHOOSE_EDIT_CATEGORY: [CallbackQueryHandler(self.choose_edit_category, pattern="^editcat_")],
-                self.CHOOSE_EDIT_FILE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.choose_edit_file)],
+                self.CHOOSE_EDIT_FILE: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.choose_edit_file), CallbackQueryHandler(self.edit_page, pattern="^editpg_")
+                ],
                 self.CHOOSE_EDIT_FIELD: [CallbackQueryHandler(self.choose_edit_field, pattern="^editfield_")],
                 self.GET_NEW_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.get_new_value_and_save)],
-            }, fallbacks=[CommandHandler("batal", self.cancel)], per_message=True
+            }, fallbacks=[CommandHandler("batal", self.cancel)]
         )
 
         self.application.add_handler(add_conv); self.application.add_handler(delete_conv); self.application.add_handler(edit_conv)
         self.application.add_handler(CommandHandler("start", self.start_command)); self.application.add_handler(CommandHandler("status", self.status_command))
         self.application.add_handler(CommandHandler("summary", self.summary_command)); self.application.add_handler(CommandHandler("list", self.list_data))
         self.application.add_handler(CommandHandler("export", self.export_data)); self.application.add_handler(CommandHandler("tambah_kategori", self.add_category_command))
-        self.application.add_handler(CommandHandler("hapus_kategori", self.remove_category_command))
-        
-        logger.info("Bot v3.1 (Full Feature) dimulai...")
-        self.application.run_polling()
+        self.application.add_handler(CommandHandler("hapus_kategori", self.remove_category_command)); self.application.add_handler(CommandHandler("sinkron", self.sync_command))
+        self.application.add_handler(CommandHandler("pindah", self.move_command)); self.application.add_handler(CommandHandler("ytd", self.ytd_command))
+        self.application.add_handler(CommandHandler("metrics", self.metrics_command)); self.application.add_handler(CallbackQueryHandler(self.list_page, pattern="^listpg_"))
+        # Nama perintah bawaan tidak boleh dipakai sebagai kategori
+        for handler in self.application.handlers[0]:
+            for h in [handler] + list(getattr(handler, 'entry_points', [])) + list(getattr(handler, 'fallbacks', [])):
+                if isinstance(h, CommandHandler): self._builtin_commands.update(h.commands)
+        self._instrument_handlers()
+
+        if self.config.BOT_MODE == 'webhook':
+            if not self.config.WEBHOOK_URL:
+                logger.critical("BOT_MODE=webhook membutuhkan WEBHOOK_URL!"); return
+            logger.info("Bot v3.1 (Full Feature) dimulai dalam mode webhook...")
+            asyncio.run(self._run_webhook())
+        else:
+            logger.info("Bot v3.1 (Full Feature) dimulai...")
+            self.application.run_polling()
 
 if __name__ == "__main__":
     bot = RembesBot()